@@ -1,12 +1,185 @@
 
+# how many constants the delta rule may introduce on one branch before the
+# answer is undetermined, read on every call (a Budget can override it)
 MAX_CONSTANTS = 10
 
+# how many branches may run out of constants, each of them set aside while
+# the search looks for an open one elsewhere, before it gives up with 2
+MAX_SET_ASIDE = 128
+
+# how many sets of formulas found to close a branch a search remembers, so
+# that any later branch holding one of them closes straight away (0 stops
+# it keeping track of why branches close at all), how many formulas such a
+# set may have before the search stops following it, and whether a beta
+# formula is left unsplit when one of its sides is already on the branch;
+# all three are read on every call
+MAX_LEMMAS = 4096
+LEMMA_SIZE = 64
+REGULAR = True
+
+# constants the tableau introduces are c, d, ..., l, then c1, d1, ..., l1,
+# c2 and so on (see constant_name); the lexer reads digits after these
+# letters as part of the constant
+CONSTANT_LETTERS = 'cdefghijkl'
+
+###### interned formulas
+
+# every distinct subformula is built exactly once and shared through
+# _FORMULA_TABLE, so two formulas are equal iff they are the same object and
+# every node carries a small integer id the tableau can key its sets on
+class Formula:
+    __slots__ = ('id', 'op', 'a', 'b', 'free')
+
+    # a and b hold what used to be positions 1 and 2 of the nested tuples:
+    # ('PROP_VAR', name), ('FOL_VAR', name), ('NEGATION', sub),
+    # (quantifier, var, sub), (connective, left, right), ('PRED', name, args)
+    # free is the frozenset of variable names occurring free in the node
+    def __init__(self, id, op, a, b, free):
+        self.id = id
+        self.op = op
+        self.a = a
+        self.b = b
+        self.free = free
+
+    def as_tuple(self):
+        if self.b is None:
+            return (self.op, self.a)
+        return (self.op, self.a, self.b)
+
+    # keep indexing like the old tuples so node[0], node[1][2] etc. still work
+    def __getitem__(self, index):
+        if index == 0:
+            return self.op
+        elif index == 1:
+            return self.a
+        return self.as_tuple()[index]
+
+    def __len__(self):
+        return 2 if self.b is None else 3
+
+    # re-intern on unpickling so identity equality holds in the new process
+    def __reduce__(self):
+        return (make_formula, (self.op, self.a, self.b))
+
+    def __repr__(self):
+        return repr(self.as_tuple())
+
+_FORMULA_TABLE = {}
+_FORMULAS = []
+_NO_VARIABLES = frozenset()
+
+# return the unique node for (op, a, b), creating it on first use
+def make_formula(op, a, b=None):
+    key = (op, a, b)
+    node = _FORMULA_TABLE.get(key)
+    if node is None:
+        node = Formula(len(_FORMULAS), op, a, b, free_variables(op, a, b))
+        _FORMULA_TABLE[key] = node
+        _FORMULAS.append(node)
+    return node
+
+def formula_by_id(formula_id):
+    return _FORMULAS[formula_id]
+
+# forget every interned formula and everything cached about them; nodes built
+# before the call must not be mixed with nodes built after it, so any Formula
+# a caller still holds (a Theory's, say) is invalid afterwards
+def clear_formula_table():
+    _FORMULA_TABLE.clear()
+    del _FORMULAS[:]
+    _SUBSTITUTIONS.clear()
+    _LAST_ANALYSED.clear()
+
+# set in a process where nothing outside this module holds interned formulas:
+# the command line modes and the batch workers. only then does the module
+# clear the table by itself, to bound it or to measure from a fresh one
+_OWN_FORMULAS = False
+
+def own_formula_table():
+    global _OWN_FORMULAS
+    _OWN_FORMULAS = True
+
+# free variables of a node about to be built from already interned children
+def free_variables(op, a, b):
+    if op == 'FOL_VAR':
+        return frozenset((a,))
+    elif op == 'PROP_VAR' or op in TRUTH_CONSTANTS:
+        return _NO_VARIABLES
+    elif op == 'NEGATION':
+        return a.free
+    elif op in ('FORALL', 'EXISTS'):
+        if a in b.free:
+            return b.free - {a}
+        return b.free
+    elif op == 'PRED':
+        free = _NO_VARIABLES
+        for arg in b:
+            free = free | arg.free
+        return free
+    else:
+        return a.free | b.free
+
+###### substitution
+
+_SUBSTITUTIONS = {}
+
+# replace the free occurrences of var in formula by term, renaming bound
+# variables that would otherwise capture a variable of term
+def substitute(formula, var, term):
+    if var not in formula.free:
+        return formula
+    key = (formula, var, term)
+    result = _SUBSTITUTIONS.get(key)
+    if result is not None:
+        return result
+
+    op = formula.op
+    if op == 'FOL_VAR':
+        result = term
+    elif op == 'NEGATION':
+        result = make_formula('NEGATION', substitute(formula.a, var, term))
+    elif op in ('FORALL', 'EXISTS'):
+        bound = formula.a
+        body = formula.b
+        if bound in term.free:
+            fresh = fresh_variable(body.free | term.free)
+            body = substitute(body, bound, make_formula('FOL_VAR', fresh))
+            bound = fresh
+        result = make_formula(op, bound, substitute(body, var, term))
+    elif op == 'PRED':
+        args = tuple(substitute(arg, var, term) for arg in formula.b)
+        result = make_formula('PRED', formula.a, args)
+    else:
+        result = make_formula(op, substitute(formula.a, var, term), substitute(formula.b, var, term))
+
+    _SUBSTITUTIONS[key] = result
+    return result
+
+# first variable name not in taken, trying the language's own letters first
+def fresh_variable(taken):
+    for name in 'xyzw':
+        if name not in taken:
+            return name
+    i = 1
+    while 'x' + str(i) in taken:
+        i += 1
+    return 'x' + str(i)
+
 ###### parsing formula
 
+# tokens are shared constant tuples, looked up per character (or per pair of
+# characters for the connectives) instead of walking an if/elif chain
+_SINGLE_TOKENS = {'(': ('LPAREN', '('), ')': ('RPAREN', ')'), ',': ('COMMA', ','),
+                  '~': ('NEGATION', '~'), 'A': ('FORALL', 'A'), 'E': ('EXISTS', 'E')}
+for letter in 'PQRS':
+    _SINGLE_TOKENS[letter] = ('PRED', letter)
+for letter in 'pqrs':
+    _SINGLE_TOKENS[letter] = ('PROP_VAR', letter)
+for letter in 'xyzwcdefghijkl':
+    _SINGLE_TOKENS[letter] = ('FOL_VAR', letter)
+_PAIR_TOKENS = {'/\\': ('CONJUNCTION', '/\\'), '\\/': ('DISJUNCTION', '\\/'), '=>': ('IMPLICATION', '=>')}
+
 def lexer(formula):
-    tokens = []
-    i = 0
-    
     # if formula contains a "/r", change it to "//r" (special case)
     if "\r" in formula:
         formula = formula.replace("\r", "\\r")
@@ -22,232 +195,512 @@ def lexer(formula):
         # print("Error: formula must have equal numbers of '(' and ')'")
         return None
 
-    # go through the input formula and tokenize it
-    while i < len(formula):
-        if formula[i] == '(':
-            tokens.append(('LPAREN', '('))
-            i += 1
-        elif formula[i] == ')':
-            tokens.append(('RPAREN', ')'))
-            i += 1
-        elif formula[i] == ',':
-            tokens.append(('COMMA', ','))
-            i += 1
-        elif formula[i] == '~':
-            tokens.append(('NEGATION', '~'))
+    # go through the input formula and tokenize it in one pass
+    tokens = []
+    append = tokens.append
+    single = _SINGLE_TOKENS
+    pair = _PAIR_TOKENS
+    i = 0
+    n = len(formula)
+    while i < n:
+        token = single.get(formula[i])
+        if token is not None:
             i += 1
-        elif formula[i:i+2] == '/\\':
-            tokens.append(('CONJUNCTION', '/\\'))
-            i += 2
-        elif formula[i:i+2] == '\\/':
-            tokens.append(('DISJUNCTION', '\\/'))
-            i += 2
-        elif formula[i:i+2] == '=>':
-            tokens.append(('IMPLICATION', '=>'))
+            if i < n and formula[i].isdigit() and formula[i - 1] in CONSTANT_LETTERS:
+                # multi-character constant such as c12
+                start = i - 1
+                while i < n and formula[i].isdigit():
+                    i += 1
+                token = ('FOL_VAR', formula[start:i])
+            append(token)
+            continue
+        token = pair.get(formula[i:i+2])
+        if token is not None:
+            append(token)
             i += 2
-        elif formula[i] == 'A':
-            tokens.append(('FORALL', 'A'))
-            i += 1
-        elif formula[i] == 'E':
-            tokens.append(('EXISTS', 'E'))
-            i += 1
-        elif formula[i] in 'PQRS':
-            tokens.append(('PRED', formula[i]))
-            i += 1
-        elif formula[i] in 'pqrs':
-            tokens.append(('PROP_VAR', formula[i]))
-            i += 1
-        elif formula[i] in 'xyzwcdefghijkl':
-            tokens.append(('FOL_VAR', formula[i]))
-            i += 1
         else:
-            # skip whitespaces
-            if formula[i] != ' ':
-                # print(f"Unknown token: {formula[i]}")
-                i += 1
+            # skip whitespace and unknown characters
+            # print(f"Unknown token: {formula[i]}")
+            i += 1
     return tokens
 
 # parser
 def parse_formula(tokens):
-    if not tokens:
-        return None
+    return parse_tokens(tokens, 0)[0]
 
-    token = tokens.pop(0)
-    # check if var by itself
-    if token[0] == 'PROP_VAR':
-        return ('PROP_VAR', token[1])
-    elif token[0] == 'FOL_VAR':
-        return ('FOL_VAR', token[1])
-    # check for negation
-    elif token[0] == 'NEGATION':
-        subformula = parse_formula(tokens)
-        return ('NEGATION', subformula)
-    # check for quantifiers
-    elif token[0] in ['FORALL', 'EXISTS']:
-        var = tokens.pop(0)
-        subformula = parse_formula(tokens)
-        return (token[0], var[1], subformula)
-    # check for predicate expressions
-    elif token[0] == 'PRED':
-        predicate = token[1]
-        # check for beginning of subformula
-        if tokens and tokens[0][0] == 'LPAREN':
-            tokens.pop(0)
-            args = []
-            while tokens and tokens[0][0] != 'RPAREN':
-                args.append(parse_formula(tokens))
-                if tokens and tokens[0][0] == 'COMMA':
-                    # handle commas being interpreted weirdly, ie just ignore
-                    tokens.pop(0)
-            if not tokens or tokens[0][0] != 'RPAREN':
-                # print("Expected RPAREN")
-                return None
-            # check for end of subformula
-            tokens.pop(0)
-            # exactly two arguments for the predicate
-            if len(args) != 2:
-                # print("Error: Predicate must have exactly 2 arguments")
-                return None
-            return ('PRED', predicate, args)
+# parse one formula starting at tokens[i], returning it (None if it is not a
+# formula) and the index of the first token after it; tokens are never
+# mutated, and pending negations, quantifiers and brackets live on an
+# explicit stack so nesting depth is not limited by the recursion limit
+def parse_tokens(tokens, i):
+    n = len(tokens) if tokens else 0
+    stack = []
+    while True:
+        # read tokens until a complete atom (or an error) is found
+        if i >= n:
+            node = None
         else:
-            # is formula broken?
-            # print("Expected LPAREN after PRED")
-            return None
-    # check for connectives
-    elif token[0] == 'LPAREN':
-        left = parse_formula(tokens)
-        token = tokens.pop(0)
-        if token[0] in ['CONJUNCTION', 'DISJUNCTION', 'IMPLICATION']:
-            op = token[0]
-        else:
-            # print(f"Unexpected token after LPAREN: {token}")
-            return None
-        right = parse_formula(tokens)
-        if tokens and tokens[0][0] == 'RPAREN':
-            tokens.pop(0)
-            return (op, left, right)
+            kind, text = tokens[i]
+            i += 1
+            # check if var by itself
+            if kind == 'PROP_VAR' or kind == 'FOL_VAR':
+                node = make_formula(kind, text)
+            # check for negation
+            elif kind == 'NEGATION':
+                stack.append((kind,))
+                continue
+            # check for quantifiers
+            elif kind == 'FORALL' or kind == 'EXISTS':
+                if i >= n:
+                    node = None
+                else:
+                    stack.append((kind, tokens[i][1]))
+                    i += 1
+                    continue
+            # check for predicate expressions, exactly two variables or
+            # constants separated by a comma
+            elif kind == 'PRED':
+                if [token[0] for token in tokens[i:i + 5]] == ['LPAREN', 'FOL_VAR', 'COMMA', 'FOL_VAR', 'RPAREN']:
+                    args = (make_formula('FOL_VAR', tokens[i + 1][1]), make_formula('FOL_VAR', tokens[i + 3][1]))
+                    node = make_formula('PRED', text, args)
+                    i += 5
+                else:
+                    # print("Expected PRED(var,var)")
+                    node = None
+            # check for connectives
+            elif kind == 'LPAREN':
+                stack.append((kind,))
+                continue
+            else:
+                # print(f"Unexpected token: {kind}")
+                node = None
+
+        # hand the finished formula to whatever was waiting for it
+        while stack:
+            frame = stack[-1]
+            kind = frame[0]
+            if kind == 'NEGATION':
+                stack.pop()
+                if node is not None:
+                    node = make_formula('NEGATION', node)
+            elif kind == 'FORALL' or kind == 'EXISTS':
+                stack.pop()
+                if node is not None:
+                    node = make_formula(kind, frame[1], node)
+            elif kind == 'LPAREN':
+                # node is the left hand side, the connective comes next
+                stack.pop()
+                if i < n and tokens[i][0] in ('CONJUNCTION', 'DISJUNCTION', 'IMPLICATION'):
+                    stack.append(('BINARY', tokens[i][0], node))
+                    i += 1
+                    break
+                # print("Unexpected token after LPAREN")
+                if i < n:
+                    i += 1
+                node = None
+            else:
+                # both sides must be formulas
+                stack.pop()
+                left = frame[2]
+                if i < n and tokens[i][0] == 'RPAREN' and left is not None and node is not None:
+                    i += 1
+                    node = make_formula(frame[1], left, node)
+                else:
+                    # print("Expected RPAREN")
+                    node = None
         else:
-            # print("Expected RPAREN")
-            return None
-    else:
-        # print(f"Unexpected token: {token}")
-        return None
+            return node, i
+
+CONNECTIVE_SYMBOLS = {'CONJUNCTION': '/\\', 'DISJUNCTION': '\\/', 'IMPLICATION': '=>'}
+
+# everything the PARSE and SAT output need about one input line: the parsed
+# formula (None if it is not a formula), its parseOutputs code, the pieces of
+# a binary connective and whether FOL or propositional symbols occur in it
+class ParsedFormula:
+    __slots__ = ('text', 'formula', 'code', 'lhs', 'con', 'rhs', 'is_fol', 'is_prop')
+
+    def __init__(self, text, formula):
+        self.text = text
+        self.formula = formula
+        self.lhs = None
+        self.con = None
+        self.rhs = None
+        self.is_fol = False
+        self.is_prop = False
+        if not verify_no_none(formula):
+            # reject
+            self.formula = None
+            self.code = 0
+            return
+
+        # one walk below the root finds both kinds of symbols; predicates
+        # count as FOL without looking at their arguments
+        fol = False
+        prop = False
+        stack = [formula]
+        while stack and not (fol and prop):
+            node = stack.pop()
+            for token in (node.a, node.b):
+                if isinstance(token, Formula):
+                    if token.op == 'FOL_VAR' or token.op == 'PRED':
+                        fol = True
+                    elif token.op == 'PROP_VAR':
+                        prop = True
+                    else:
+                        stack.append(token)
+
+        op = formula.op
+        self.is_fol = fol or op in ('FOL_VAR', 'PRED', 'FORALL', 'EXISTS')
+        self.is_prop = prop or op == 'PROP_VAR'
+        if op in CONNECTIVE_SYMBOLS:
+            self.lhs = formula_to_string(formula.a)
+            self.con = CONNECTIVE_SYMBOLS[op]
+            self.rhs = formula_to_string(formula.b)
+
+        if fol and prop:
+            self.code = 0
+        elif op == 'FOL_VAR' or op == 'PRED':
+            self.code = 1
+        elif op == 'NEGATION':
+            # 2 if the negated formula anywhere includes a 'FOL_VAR', else 7
+            self.code = 2 if fol else 7
+        elif op == 'FORALL':
+            self.code = 3
+        elif op == 'EXISTS':
+            self.code = 4
+        elif op in CONNECTIVE_SYMBOLS:
+            # 5 if either side anywhere includes a 'FOL_VAR', else 8
+            self.code = 5 if fol else 8
+        elif op == 'PROP_VAR':
+            self.code = 6
+
+# the driver asks parse, lhs, con, rhs and theory about the same line one
+# after the other, so the last line analysed is kept and only parsed once
+_LAST_ANALYSED = {}
+
+def analyse(fmla):
+    parsed = _LAST_ANALYSED.get(fmla)
+    if parsed is None:
+        parsed = ParsedFormula(fmla, parse_formula(lexer(fmla)))
+        _LAST_ANALYSED.clear()
+        _LAST_ANALYSED[fmla] = parsed
+    return parsed
 
 # output parse_formula in format wanted by assignment
 def parse(fmla):
-    tokens = lexer(fmla)
-    parsed = parse_formula(tokens)
-    
-    if parsed and verify_no_none(parsed):
-        if contains_fol_var(parsed) and contains_prop_var(parsed):
-            return 0
-        if parsed[0] == 'FOL_VAR':
-            return 1
-        elif parsed[0] == 'NEGATION':
-            # return 2 or 7
-            # if parsed formula anywhere includes a 'FOL_VAR', return 2
-            # else return 7
-            if contains_fol_var(parsed):
-                return 2
-            else:
-                return 7
-        elif parsed[0] == 'FORALL':
-            return 3
-        elif parsed[0] == 'EXISTS':
-            return 4
-        elif parsed[0] in ['CONJUNCTION', 'DISJUNCTION', 'IMPLICATION']:
-            # return 5 or 8
-            # if parsed formula anywhere includes a 'FOL_VAR', return 5
-            # else return 8
-            if contains_fol_var(parsed):
-                return 5
-            else:
-                return 8
-        elif parsed[0] == 'PROP_VAR':
-            return 6
-    else:
-        # reject
-        return 0
+    return analyse(fmla).code
 
-# final check to make sure there are no 'None' in the parsed formula
+# final check to make sure there are no 'None' in the parsed formula, and
+# that predicates only have variables or constants as arguments
 def verify_no_none(parsed_formula):
     if parsed_formula is None:
         return False
-    elif isinstance(parsed_formula, tuple):
-        # Recursively check subformulas
-        for subformula in parsed_formula[1:]:
-            if not verify_no_none(subformula):
-                return False
-        return True
-    else:
-        # Check for 'None' at the base level
-        return True
-
-# helper function to check if a parsed formula contains xyzw
-def contains_fol_var(parsed_formula):
-    for token in parsed_formula[1:]:
-        if isinstance(token, tuple):
-            if token[0] == 'FOL_VAR':
-                # print("Found FOL_VAR")
-                return True
-            elif token[0] == 'PRED':
-                # print("Assuming it contains FOL_VAR due to PRED")
-                return True
-            elif contains_fol_var(token):
-                return True
-    return False
-
-def contains_prop_var(parsed_formula):
-    for token in parsed_formula[1:]:
-        if isinstance(token, tuple):
-            if token[0] == 'PROP_VAR':
-                # print("Found FOL_VAR")
-                return True
-            elif contains_prop_var(token):
-                return True
-    return False           
+    # check subformulas with an explicit stack, deep formulas would overflow the recursion limit
+    stack = [parsed_formula]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Formula):
+            if node.op == 'PRED':
+                if not isinstance(node.b, tuple) or len(node.b) != 2:
+                    return False
+                for arg in node.b:
+                    if not isinstance(arg, Formula) or arg.op != 'FOL_VAR':
+                        return False
+                continue
+            for subformula in node[1:]:
+                if subformula is None:
+                    return False
+                stack.append(subformula)
+    return True
 
 # Return the LHS of a binary connective formula
 def lhs(fmla):
-    formula = lexer(fmla)
-    return formula_to_string(parse_formula(formula)[1])
+    return analyse(fmla).lhs
 
 # Return the connective symbol of a binary connective formula
 def con(fmla):
-    formula = lexer(fmla)
-    dict = {'CONJUNCTION': '/\\', 'DISJUNCTION': '\\/', 'IMPLICATION': '=>'}
-    return dict[parse_formula(formula)[0]]
+    return analyse(fmla).con
 
 # Return the RHS symbol of a binary connective formula
 def rhs(fmla):
-    formula = lexer(fmla)
-    return formula_to_string(parse_formula(formula)[2])
+    return analyse(fmla).rhs
 
+# print a formula in the input syntax, building the pieces with an explicit
+# stack so deeply nested formulas print as well
 def formula_to_string(parsed_formula):
     if parsed_formula is None:
         return None
-
-    if isinstance(parsed_formula, tuple):
-        if parsed_formula[0] == 'NEGATION':
-            return f"~{formula_to_string(parsed_formula[1])}"
-        elif parsed_formula[0] == 'FORALL':
-            return f"A{parsed_formula[1]}{formula_to_string(parsed_formula[2])}"
-        elif parsed_formula[0] == 'EXISTS':
-            return f"E{parsed_formula[1]}{formula_to_string(parsed_formula[2])}"
-        elif parsed_formula[0] == 'IMPLICATION':
-            return f"({formula_to_string(parsed_formula[1])}=>{formula_to_string(parsed_formula[2])})"
-        elif parsed_formula[0] == 'CONJUNCTION':
-            return f"({formula_to_string(parsed_formula[1])}/\\{formula_to_string(parsed_formula[2])})"
-        elif parsed_formula[0] == 'DISJUNCTION':
-            return f"({formula_to_string(parsed_formula[1])}\\/{formula_to_string(parsed_formula[2])})"
-        elif parsed_formula[0] == 'PRED':
-            args = ','.join([formula_to_string(arg) for arg in parsed_formula[2]])
-            return f"{parsed_formula[1]}({args})"
-        else:
-            return parsed_formula[1]  # Variables and constants
-    else:
+    if not isinstance(parsed_formula, Formula):
         return parsed_formula  # Propositional variables and constants
 
+    parts = []
+    stack = [parsed_formula]
+    while stack:
+        item = stack.pop()
+        if not isinstance(item, Formula):
+            parts.append(item)
+            continue
+        op = item.op
+        # pieces are pushed in reverse so they come off the stack in order
+        if op == 'NEGATION':
+            stack.append(item.a)
+            parts.append('~')
+        elif op == 'FORALL' or op == 'EXISTS':
+            stack.append(item.b)
+            parts.append(('A' if op == 'FORALL' else 'E') + item.a)
+        elif op in CONNECTIVE_SYMBOLS:
+            stack += (')', item.b, CONNECTIVE_SYMBOLS[op], item.a)
+            parts.append('(')
+        elif op == 'PRED':
+            stack.append(')')
+            for i in range(len(item.b) - 1, -1, -1):
+                stack.append(item.b[i])
+                if i:
+                    stack.append(',')
+            parts.append(item.a + '(')
+        else:
+            parts.append(item.a)  # Variables and constants
+    return ''.join(parts)
+
+###### binary format
+
+# a stable binary layout for formulas, so parsed lines can be kept between
+# runs and formulas sent between processes without printing and parsing
+# them again. a file is FORMAT_MAGIC followed by records, each a kind byte,
+# a varint length and that many bytes:
+#   A  a name (UTF-8) for the atom table, which numbers the names of
+#      letters, predicates, variables and constants from 0 in the order
+#      they are defined; every name is defined before it is used
+#   T  a line of text (UTF-8)
+#   F  one formula (empty if the line before was not a formula)
+# a compiled input leaves out the T record of a line formula_to_string
+# gives back from its formula, so a line costs little more than its opcodes
+# a formula is written in prefix order as opcodes, each one byte followed
+# by its varint operands:
+#   0 name    PROP_VAR          1 name    FOL_VAR
+#   2 name n  PRED, its n arguments follow
+#   3 NEGATION, 4 CONJUNCTION, 5 DISJUNCTION, 6 IMPLICATION, operands follow
+#   7 name    FORALL            8 name    EXISTS, the body follows
+#   9 TRUE   10 FALSE   (11 is not used)
+#  12 k       the k-th node again, nodes numbered in prefix order from 0
+# so a subformula shared within a formula is only written once. varints
+# are unsigned LEB128: seven bits a byte, low bits first, the top bit set
+# on all bytes but the last
+FORMAT_MAGIC = b'TBLF\x01'
+
+FORMAT_OPCODES = {'PROP_VAR': 0, 'FOL_VAR': 1, 'PRED': 2, 'NEGATION': 3, 'CONJUNCTION': 4, 'DISJUNCTION': 5,
+                  'IMPLICATION': 6, 'FORALL': 7, 'EXISTS': 8, 'TRUE': 9, 'FALSE': 10}
+FORMAT_OPS = sorted(FORMAT_OPCODES, key=FORMAT_OPCODES.get)
+REPEAT_OPCODE = 12
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+# the varint at buffer[i] and the index after it
+def read_varint(buffer, i):
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, i
+        shift += 7
+
+# numbers names for the atom table of one file or message; names defined
+# since the last look at new are kept there until then
+class AtomTable:
+    __slots__ = ('numbers', 'names', 'new')
+
+    def __init__(self):
+        self.numbers = {}
+        self.names = []
+        self.new = []
+
+    def number(self, name):
+        number = self.numbers.get(name)
+        if number is None:
+            number = len(self.names)
+            self.numbers[name] = number
+            self.names.append(name)
+            self.new.append(name)
+        return number
+
+# append the opcodes of formula to out (a bytearray); numbers maps the
+# nodes written so far to their number, and is shared by the formulas of
+# one record or message so they can refer back to each other's nodes
+def encode_formula(formula, out, atoms, numbers):
+    stack = [formula]
+    while stack:
+        node = stack.pop()
+        number = numbers.get(node)
+        if number is not None:
+            out.append(REPEAT_OPCODE)
+            write_varint(out, number)
+            continue
+        numbers[node] = len(numbers)
+        op = node.op
+        out.append(FORMAT_OPCODES[op])
+        if op == 'PROP_VAR' or op == 'FOL_VAR':
+            write_varint(out, atoms.number(node.a))
+        elif op == 'PRED':
+            write_varint(out, atoms.number(node.a))
+            write_varint(out, len(node.b))
+            stack += reversed(node.b)
+        elif op == 'NEGATION':
+            stack.append(node.a)
+        elif op == 'FORALL' or op == 'EXISTS':
+            write_varint(out, atoms.number(node.a))
+            stack.append(node.b)
+        elif op in CONNECTIVE_SYMBOLS:
+            stack += (node.b, node.a)
+
+# the formula whose opcodes start at buffer[i] and the index after them.
+# buffer can be bytes, a memoryview or an mmap: it is only indexed, never
+# copied. names is the atom table, and nodes the nodes decoded so far in
+# the same record or message, in the order encode_formula numbered them
+def decode_formula(buffer, i, names, nodes):
+    # unfinished nodes as [op, name, children needed, children, number]
+    stack = []
+    while True:
+        code = buffer[i]
+        i += 1
+        if code == REPEAT_OPCODE:
+            number, i = read_varint(buffer, i)
+            node = nodes[number]
+        else:
+            op = FORMAT_OPS[code]
+            number = len(nodes)
+            nodes.append(None)
+            if op == 'PROP_VAR' or op == 'FOL_VAR':
+                name, i = read_varint(buffer, i)
+                node = make_formula(op, names[name])
+            elif op == 'TRUE' or op == 'FALSE':
+                node = truth_constant(op == 'TRUE')
+            else:
+                name = None
+                needed = 1
+                if op == 'PRED':
+                    name, i = read_varint(buffer, i)
+                    needed, i = read_varint(buffer, i)
+                    name = names[name]
+                elif op == 'FORALL' or op == 'EXISTS':
+                    name, i = read_varint(buffer, i)
+                    name = names[name]
+                elif op != 'NEGATION':
+                    needed = 2
+                if needed == 0:
+                    node = make_formula(op, name, ())
+                else:
+                    stack.append([op, name, needed, [], number])
+                    continue
+            nodes[number] = node
+        # hand finished nodes up to the ones waiting for them
+        while stack:
+            frame = stack[-1]
+            frame[3].append(node)
+            if len(frame[3]) < frame[2]:
+                break
+            stack.pop()
+            op, name, _, children, number = frame
+            if op == 'NEGATION':
+                node = make_formula(op, children[0])
+            elif op == 'PRED':
+                node = make_formula(op, name, tuple(children))
+            elif name is not None:
+                node = make_formula(op, name, children[0])
+            else:
+                node = make_formula(op, children[0], children[1])
+            nodes[number] = node
+        else:
+            return node, i
+
+# writes records in the format above to a binary stream
+class FormulaWriter:
+    def __init__(self, out):
+        self.out = out
+        self.atoms = AtomTable()
+        out.write(FORMAT_MAGIC)
+
+    def record(self, kind, payload):
+        header = bytearray(kind)
+        write_varint(header, len(payload))
+        self.out.write(header)
+        self.out.write(payload)
+
+    def write_text(self, text):
+        self.record(b'T', text.encode('utf-8'))
+
+    # formula can be None, for a line that is not a formula
+    def write_formula(self, formula):
+        body = bytearray()
+        if formula is not None:
+            encode_formula(formula, body, self.atoms, {})
+        for name in self.atoms.new:
+            self.record(b'A', name.encode('utf-8'))
+        del self.atoms.new[:]
+        self.record(b'F', body)
+
+# the text and formula records of buffer, a whole file in the format above,
+# as ('T', text) and ('F', formula or None) pairs; formulas are decoded
+# straight out of buffer, so a memoryview or mmap of a large file is never
+# copied
+def read_records(buffer):
+    if bytes(buffer[:len(FORMAT_MAGIC)]) != FORMAT_MAGIC:
+        raise ValueError('not a formula file')
+    return iter_records(buffer, len(FORMAT_MAGIC), [])
+
+# the records of buffer from i on, as read_records gives them; names is
+# the atom table as it stands at i and grows with the A records read
+def iter_records(buffer, i, names):
+    end = len(buffer)
+    while i < end:
+        kind = buffer[i]
+        length, i = read_varint(buffer, i + 1)
+        start = i
+        i += length
+        if i > end:
+            raise ValueError('record at %d is cut short' % start)
+        if kind == ord('F'):
+            if length == 0:
+                yield 'F', None
+            else:
+                try:
+                    formula, stop = decode_formula(buffer, start, names, [])
+                except IndexError:
+                    raise ValueError('formula record at %d is cut short or uses an undefined name' % start)
+                if stop != i:
+                    raise ValueError('formula record at %d has %d extra bytes' % (start, i - stop))
+                yield 'F', formula
+        elif kind == ord('T'):
+            yield 'T', bytes(buffer[start:i]).decode('utf-8')
+        elif kind == ord('A'):
+            names.append(bytes(buffer[start:i]).decode('utf-8'))
+        else:
+            raise ValueError('unknown record %r at %d' % (chr(kind), start))
+
+# write formulas (None for "not a formula") to a file at path
+def dump_formulas(formulas, path):
+    with open(path, 'wb') as out:
+        writer = FormulaWriter(out)
+        for formula in formulas:
+            writer.write_formula(formula)
+
+# the formulas in a file written by dump_formulas, read through mmap
+def load_formulas(path):
+    import mmap
+    with open(path, 'rb') as stream:
+        if stream.seek(0, 2) == 0:
+            raise ValueError('not a formula file')
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for kind, formula in read_records(buffer):
+                if kind == 'F':
+                    yield formula
+
 ###### determining satisfiability
 
 # class to represent a tableau
@@ -259,33 +712,254 @@ def build_tableau(formula):
     root = TableauNode([formula])
     return root
 
+ATOMS = ('PROP_VAR', 'FOL_VAR', 'PRED')
+
+# one branch of the tableau, stored persistently so siblings share
+# everything above their split:
+# - parent is the branch segment this one extends, and positive/negative
+#   only hold the atom ids of literals added since that split
+# - formulas (branching ones kept apart in betas so they are split after
+#   everything that does not branch) and universals are immutable (node,
+#   rest) stacks, so pushing onto a child never touches the stack its
+#   sibling sees
+# - (universal, constant) pairs waiting for the gamma rule are a stack and
+#   existentials waiting for the delta rule a persistent queue (see
+#   queue_push). once formulas is empty the gamma instances for the constants
+#   in use, of which there are finitely many, all go on, then the betas are
+#   split, and only then does the next delta bring in a constant; as there
+#   is only ever finitely much to do between two deltas and existentials are
+#   taken first come first served, no rule can starve another
+# - instantiated holds the universals and (universal, constant) pairs this
+#   segment has seen, so no instance is ever added to a branch twice
+# - constants is the stack of constants in use on this branch (those free in
+#   the input and those the delta rule introduced here, introduced counting
+#   the latter), so siblings can each reuse the same names; next_constant is
+#   the index of the next name constant_name may give out
+# - pending counts the formulas still waiting on any of the stacks
+# - added holds the ids of the other formulas this segment has put on, so
+#   none of them is expanded twice on a branch either (added_parent is the
+#   nearest segment above that put any on), and premises maps the
+#   id of each formula the segment put on to that of the one it came from
+#   (see closed_on in is_satisfiable); split is the Split this branch is a
+#   side of, if the search is keeping track of why branches close
+# - clash is the atom whose complement closed the branch, and trace the rule
+#   applications made on this segment when a proof is being recorded (None
+#   otherwise), see tableau_proof
+class Branch:
+    __slots__ = ('parent', 'formulas', 'betas', 'universals', 'existentials', 'instances',
+                 'instantiated', 'constants', 'introduced', 'next_constant', 'added', 'added_parent', 'premises',
+                 'split',
+                 'positive', 'negative', 'closed', 'clash', 'trace', 'pending')
+
+    def __init__(self, parent=None):
+        self.positive = set()
+        self.negative = set()
+        self.instantiated = set()
+        self.added = set()
+        self.premises = {}
+        self.split = None
+        self.closed = False
+        self.clash = None
+        self.trace = None
+        if parent is None:
+            self.parent = None
+            self.added_parent = None
+            self.formulas = None
+            self.betas = None
+            self.universals = None
+            self.existentials = EMPTY_QUEUE
+            self.instances = None
+            self.constants = None
+            self.introduced = 0
+            self.next_constant = 0
+            self.pending = 0
+        else:
+            # segments that added nothing to look up are skipped when walking up
+            if parent.positive or parent.negative or parent.instantiated:
+                self.parent = parent
+            else:
+                self.parent = parent.parent
+            self.added_parent = parent if parent.added else parent.added_parent
+            self.formulas = parent.formulas
+            self.betas = parent.betas
+            self.universals = parent.universals
+            self.existentials = parent.existentials
+            self.instances = parent.instances
+            self.constants = parent.constants
+            self.introduced = parent.introduced
+            self.next_constant = parent.next_constant
+            self.pending = parent.pending
+
+    # does the literal (atom, polarity) occur anywhere on the branch
+    def contains(self, atom, positive):
+        branch = self
+        while branch is not None:
+            if atom in (branch.positive if positive else branch.negative):
+                return True
+            branch = branch.parent
+        return False
+
+    # has the universal, or the (universal, constant) pair, been seen on the branch
+    def has_instantiated(self, key):
+        branch = self
+        while branch is not None:
+            if key in branch.instantiated:
+                return True
+            branch = branch.parent
+        return False
+
+    # has the formula with this id (one that is not a literal) been put on the branch
+    def has_added(self, key):
+        branch = self
+        while branch is not None:
+            if key in branch.added:
+                return True
+            branch = branch.added_parent
+        return False
+
+    # is node already on the branch, as a literal, a universal or any other formula
+    def has(self, node):
+        node = double_negation(node)
+        if node.op in ATOMS:
+            return self.contains(node.id, True)
+        if node.op == 'NEGATION' and node.a.op in ATOMS:
+            return self.contains(node.a.id, False)
+        return self.has_added(node.id) or node.op == 'FORALL' and self.has_instantiated(node)
+
+    # put node (which came from premise, if given) on the branch unless it is
+    # there already; literals go straight into the index and close the
+    # branch the moment their complement is already there
+    def add(self, node, premise=None):
+        node = double_negation(node)
+        if node.op in ATOMS:
+            if self.contains(node.id, True):
+                return
+            self.positive.add(node.id)
+            if self.contains(node.id, False):
+                self.closed = True
+                self.clash = node
+        elif node.op == 'NEGATION' and node.a.op in ATOMS:
+            if self.contains(node.a.id, False):
+                return
+            self.negative.add(node.a.id)
+            if self.contains(node.a.id, True):
+                self.closed = True
+                self.clash = node.a
+        else:
+            if self.has_added(node.id):
+                return
+            self.added.add(node.id)
+            if is_beta(node):
+                self.betas = (node, self.betas)
+            else:
+                self.formulas = (node, self.formulas)
+            self.pending += 1
+        if premise is not None:
+            self.premises[node.id] = premise.id
+
+    def add_existential(self, node):
+        self.existentials = queue_push(self.existentials, node)
+        self.pending += 1
+
+    # a universal reaching the branch is owed an instance for every constant
+    # in use; one that is already on the branch is owed nothing new
+    def add_universal(self, node, constants):
+        if self.has_instantiated(node):
+            return
+        self.instantiated.add(node)
+        self.universals = (node, self.universals)
+        for constant in constants:
+            self.add_instance(node, constant)
+
+    # a new constant is owed an instance of every universal on the branch
+    def add_constant(self, constant):
+        self.constants = (constant, self.constants)
+        for universal in iter_stack(self.universals):
+            self.add_instance(universal, constant)
+
+    def add_instance(self, universal, constant):
+        key = (universal, constant)
+        if self.has_instantiated(key):
+            return
+        self.instantiated.add(key)
+        self.instances = (key, self.instances)
+        self.pending += 1
+
+    def pop_formula(self):
+        node, self.formulas = self.formulas
+        self.pending -= 1
+        return node
+
+    def pop_beta(self):
+        node, self.betas = self.betas
+        self.pending -= 1
+        return node
+
+    def pop_existential(self):
+        node, self.existentials = queue_pop(self.existentials)
+        self.pending -= 1
+        return node
+
+    def pop_instance(self):
+        key, self.instances = self.instances
+        self.pending -= 1
+        return key
+
+# a beta step of a search that keeps track of why branches close: branch
+# was split on node into sides of which waiting have not closed yet, core
+# gathers the ids of the formulas on branch their closing needed, and done
+# is set once branch is known to close, after which nothing below it needs
+# to be looked at
+class Split:
+    __slots__ = ('branch', 'node', 'waiting', 'core', 'done')
+
+    def __init__(self, branch, node, waiting):
+        self.branch = branch
+        self.node = node
+        self.waiting = waiting
+        self.core = set()
+        self.done = False
+
+# has a split above branch already been settled, so that it need not be expanded
+def settled(branch):
+    split = branch.split
+    while split is not None:
+        if split.done:
+            return True
+        split = split.branch.split
+    return False
+
+# walk one of the (node, rest) stacks of a branch
+def iter_stack(stack):
+    while stack is not None:
+        yield stack[0]
+        stack = stack[1]
+
+# persistent first in first out queue made of two such stacks, (front, back):
+# items are pushed onto back and popped from front, which is refilled by
+# reversing back when it runs out. old versions stay valid, so a branch and
+# its children can each keep taking from the queue they inherited
+EMPTY_QUEUE = (None, None)
+
+def queue_push(queue, item):
+    return (queue[0], (item, queue[1]))
+
+# the oldest item and the queue without it
+def queue_pop(queue):
+    front, back = queue
+    if front is None:
+        while back is not None:
+            front = (back[0], front)
+            back = back[1]
+    return front[0], (front[1], back)
+
 # checks if branch is closed
 def is_closed(branch):
-    temp_list = []
+    indexed = Branch()
     for node in branch:
-        node = double_negation(node)
-        # print(f"node: {node}")
-        if node[0] == 'NEGATION':
-            if node[1][0] == 'PROP_VAR' or node[1][0] == 'FOL_VAR':
-                temp_list.append("-" + node[1][1])
-            elif node[1][0] == 'PRED':
-                temp_list.append("-" + node[1][1] + node[1][2][0][1] + node[1][2][1][1])
-            # print(f"node[0][1][1]: {node[0][1][1]}")
-        else:
-            if node[0] == 'PROP_VAR' or node[0] == 'FOL_VAR':
-                temp_list.append(node[1]) 
-            elif node[0] == 'PRED':
-                temp_list.append((node[1] + node[2][0][1] + node[2][1][1]))    
-
-    # print(f"temp_list: {temp_list}")
-    # Check if any letters in the temp_list have a complement, i.e., p and -p
-    for letter in temp_list:
-        # print(f"letter: {letter}")
-        if letter[0] == '-':
-            complement = letter[1:]
-            if complement in temp_list:
-                return True
-
+        indexed.add(node)
+        if indexed.closed:
+            return True
     return False
 
 def double_negation(node):
@@ -302,25 +976,30 @@ def alpha_expansion(node):
         return [node[1], node[2]]
     elif node[0] == 'NEGATION' and node[1][0] == 'DISJUNCTION':
         # Apply alpha expansion for negation of disjunction
-        return [('NEGATION', node[1][1]), ('NEGATION', node[1][2])]
+        return [make_formula('NEGATION', node[1][1]), make_formula('NEGATION', node[1][2])]
     elif node[0] == 'NEGATION' and node[1][0] == 'IMPLICATION':
         # Apply alpha expansion for negation of implication
-        return [node[1][1], ('NEGATION', node[1][2])]
+        return [node[1][1], make_formula('NEGATION', node[1][2])]
     else:
         # print('Not alpha, skipping')
         return node
 
+def is_beta(node):
+    if node.op == 'NEGATION':
+        return node.a.op == 'CONJUNCTION'
+    return node.op in ('DISJUNCTION', 'IMPLICATION')
+
 def beta_expansion(node):
     # print(f"Beta expansion for {node}")
     if node[0] == 'NEGATION' and node[1][0] == 'CONJUNCTION':
         # Apply beta expansion for negation of conjunction
-        return [('NEGATION', node[1][1]), ('NEGATION', node[1][2])]
+        return [make_formula('NEGATION', node[1][1]), make_formula('NEGATION', node[1][2])]
     elif node[0] == 'DISJUNCTION':
         # Apply beta expansion for disjunction
         return [node[1], node[2]]
     elif node[0] == 'IMPLICATION':
         # Apply beta expansion for implication
-        return [('NEGATION', node[1]), node[2]]
+        return [make_formula('NEGATION', node[1]), node[2]]
     else:
         # print('Not beta, skipping')
         return node
@@ -329,13 +1008,20 @@ def beta_expansion(node):
 def clean_fol_formula(formula):
     # change ~ExA to Ax~A
     if formula[0] == 'NEGATION' and formula[1][0] == 'EXISTS':
-        formula = ('FORALL', formula[1][1], ('NEGATION', formula[1][2]))
+        formula = make_formula('FORALL', formula[1][1], make_formula('NEGATION', formula[1][2]))
     # change ~AxA to Ex~A
     if formula[0] == 'NEGATION' and formula[1][0] == 'FORALL':
-        formula = ('EXISTS', formula[1][1], ('NEGATION', formula[1][2]))
+        formula = make_formula('EXISTS', formula[1][1], make_formula('NEGATION', formula[1][2]))
     
     return formula
 
+# the i-th name (from 0) the delta rule can give a new constant
+def constant_name(i):
+    letter = CONSTANT_LETTERS[i % len(CONSTANT_LETTERS)]
+    if i < len(CONSTANT_LETTERS):
+        return letter
+    return letter + str(i // len(CONSTANT_LETTERS))
+
 def delta_expansion(node, var):
     # introducing a new variable
     # variable must be introduced earlier, kept in is_satisfiable
@@ -343,13 +1029,8 @@ def delta_expansion(node, var):
     node = clean_fol_formula(node)
 
     if node[0] == 'EXISTS':
-        var_to_change = node[1]
-        node = node[2]
-        translated_fol_vars = formula_to_string(node)
-        
-        # 3. change all instances of the variable to the new variable
-        translated_fol_vars = translated_fol_vars.replace(var_to_change, var)  
-        return parse_formula(lexer(translated_fol_vars))    
+        # 3. change all free instances of the variable to the new variable
+        return substitute(node[2], node[1], make_formula('FOL_VAR', var))
     
     # 4. return the node if not
     # print("not delta, skipping")
@@ -364,11 +1045,9 @@ def gamma_expansion(node, list_of_existing_vars):
         node = node[2]
         return_list = []
     
-        # 3. change all instances of the variable to the new variable
+        # 3. change all free instances of the variable to the new variable
         for var in list_of_existing_vars:
-            translated_fol_vars = formula_to_string(node)
-            translated_fol_vars = translated_fol_vars.replace(var_to_change, var)
-            return_list.append(parse_formula(lexer(translated_fol_vars)))
+            return_list.append(substitute(node, var_to_change, make_formula('FOL_VAR', var)))
             
         # 4. return the new node
         return return_list
@@ -376,269 +1055,3795 @@ def gamma_expansion(node, list_of_existing_vars):
     # print("not gamma, skipping")
     return node
 
-def is_satisfiable(tableau):
-    # way this is structured: 
-    # used vars is empty at first, then as we go through the tableau, we add used vars to it
-    # available vars is a list of vars that are not used yet, so abcdefghij
-    used_vars = []
-    available_vars = []
-    # fill available_vars with all letters
-    for letter in 'cdefghijkl':
-        available_vars.append(letter)
-
-    stck = [[tableau.nodes]]
-    gamma_nodes = []
-    gamma_expanded_formulae = []
-    # root
-    # print(f"Stck at Root: {stck}")
-    num_branches_at_end = 0
-    closed_branches = 0
-    literals_to_handle = []
+###### scheduling open branches
+
+# the frontier of branches waiting to be expanded; is_satisfiable only needs
+# push, pop and len, so new search orders can be added to SCHEDULERS
+
+# depth first: an explicit stack, so memory is bounded by the tableau depth
+class DepthFirst:
+    def __init__(self):
+        self.items = []
+
+    def push(self, branch):
+        self.items.append(branch)
+
+    def pop(self):
+        return self.items.pop()
+
+    def __len__(self):
+        return len(self.items)
+
+# breadth first: a list used as a queue, compacted once half of it is spent
+class BreadthFirst:
+    def __init__(self):
+        self.items = []
+        self.head = 0
+
+    def push(self, branch):
+        self.items.append(branch)
+
+    def pop(self):
+        branch = self.items[self.head]
+        self.items[self.head] = None
+        self.head += 1
+        if self.head * 2 > len(self.items):
+            del self.items[:self.head]
+            self.head = 0
+        return branch
+
+    def __len__(self):
+        return len(self.items) - self.head
+
+# a binary min-heap in a list, for the schedulers and the CDCL solver
+def heap_push(heap, entry):
+    heap.append(entry)
+    i = len(heap) - 1
+    while i > 0:
+        parent = (i - 1) // 2
+        if heap[parent] <= entry:
+            break
+        heap[i] = heap[parent]
+        i = parent
+    heap[i] = entry
+
+def heap_pop(heap):
+    top = heap[0]
+    last = heap.pop()
+    if heap:
+        i = 0
+        n = len(heap)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap[child + 1] < heap[child]:
+                child += 1
+            if last <= heap[child]:
+                break
+            heap[i] = heap[child]
+            i = child
+        heap[i] = last
+    return top
+
+# best first: a heap on the number of formulas left to expand, ties broken
+# by insertion order
+class BestFirst:
+    def __init__(self):
+        self.heap = []
+        self.count = 0
+
+    def push(self, branch):
+        heap_push(self.heap, (branch.pending, self.count, branch))
+        self.count += 1
+
+    def pop(self):
+        return heap_pop(self.heap)[2]
+
+    def __len__(self):
+        return len(self.heap)
+
+SCHEDULERS = {'dfs': DepthFirst, 'bfs': BreadthFirst, 'best': BestFirst}
+
+###### budgets
+
+# limits for one is_satisfiable call, None means unlimited; max_memory is the
+# resident size of the process in bytes
+class Budget:
+    __slots__ = ('max_steps', 'max_branches', 'max_memory', 'max_seconds', 'max_constants', 'cancel')
+
+    def __init__(self, max_steps=None, max_branches=None, max_memory=None, max_seconds=None,
+                 max_constants=None, cancel=None):
+        self.max_steps = max_steps
+        self.max_branches = max_branches
+        self.max_memory = max_memory
+        self.max_seconds = max_seconds
+        # constants per branch, None means MAX_CONSTANTS
+        self.max_constants = max_constants
+        # anything with an is_set method, such as a multiprocessing Event;
+        # the search stops once it is set
+        self.cancel = cancel
+
+# steps between two looks at the clock and the memory in use
+BUDGET_CHECK_INTERVAL = 256
+
+# the answer of is_satisfiable; it is the 0/1/2 code itself, and also says
+# why the answer is undetermined (None otherwise) and how far the search got
+class SatResult(int):
+    def __new__(cls, code, reason=None, stats=None, witness=None):
+        result = int.__new__(cls, code)
+        result.reason = reason
+        result.stats = stats
+        # a Model or Proof when one was asked for, see the witnesses section
+        result.witness = witness
+        return result
+
+# which limit of budget has run out after steps steps (started is the
+# clock reading at the start, when there is a time limit), None if none has
+def budget_exceeded(budget, steps, clock, started):
+    if budget.max_steps is not None and steps > budget.max_steps:
+        return 'steps'
+    if clock is not None and clock() - started > budget.max_seconds:
+        return 'time'
+    if budget.max_memory is not None and memory_in_use() > budget.max_memory:
+        return 'memory'
+    if budget.cancel is not None and budget.cancel.is_set():
+        return 'cancelled'
+    return None
+
+# what is left of budget once a search has used up the steps and seconds in
+# its stats, for another search to carry on with
+def budget_left(budget, stats):
+    if budget is None:
+        return None
+    max_steps = budget.max_steps
+    if max_steps is not None:
+        max_steps = max(max_steps - stats['steps'], 0)
+    max_seconds = budget.max_seconds
+    if max_seconds is not None:
+        max_seconds = max(max_seconds - stats.get('seconds', 0), 0)
+    return Budget(max_steps, budget.max_branches, budget.max_memory, max_seconds, budget.max_constants,
+                  budget.cancel)
+
+# the step at which budget has to be looked at again
+def next_budget_check(budget, steps):
+    if budget.max_steps is not None:
+        return min(steps + BUDGET_CHECK_INTERVAL, budget.max_steps + 1)
+    return steps + BUDGET_CHECK_INTERVAL
+
+# resident set size of this process in bytes
+def memory_in_use():
+    import os
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # no /proc, fall back to the peak size
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+###### instrumentation
+
+# what a Probe counts
+PROBE_COUNTERS = ('alpha', 'beta', 'gamma', 'delta', 'closure_checks', 'branches_opened', 'branches_closed',
+                  'constants', 'set_aside')
+
+# instrumentation for is_satisfiable, which reports to it after every rule
+# it applies when one is passed in; without one the search pays a single
+# None test per step. events are 'start', 'alpha', 'beta', 'gamma',
+# 'delta', 'constant', 'closed', 'set_aside', 'open' (a saturated branch)
+# and 'result', each going to the callbacks registered with on as
+# callback(event, node, detail) and, with log (a text stream), written to
+# it as one JSON object per line: the event, the formula it is about, its
+# detail (the constant, the number of children or the answer) and the
+# microseconds since the previous event, which flame_summary folds up
+class Probe:
+    __slots__ = ('counts', 'callbacks', 'log', 'clock', 'last')
+
+    def __init__(self, log=None):
+        self.counts = dict.fromkeys(PROBE_COUNTERS, 0)
+        self.callbacks = {}
+        self.log = log
+        self.clock = None
+        self.last = None
+        if log is not None:
+            import time
+            self.clock = time.perf_counter
+
+    def on(self, event, callback):
+        self.callbacks.setdefault(event, []).append(callback)
+        return self
+
+    def emit(self, event, node=None, detail=None):
+        for callback in self.callbacks.get(event, ()):
+            callback(event, node, detail)
+        if self.log is not None:
+            import json
+            now = self.clock()
+            elapsed = 0 if self.last is None else int((now - self.last) * 1000000)
+            self.last = now
+            text = None if node is None else formula_to_string(node)
+            self.log.write(json.dumps({'e': event, 'n': text, 'x': detail, 'us': elapsed}) + '\n')
+
+    # rule applied to node put the formulas added on branch; every literal
+    # among them was checked against the branch for a complement
+    def applied(self, rule, node, added, branch, detail=None):
+        counts = self.counts
+        counts[rule] += 1
+        for formula in added:
+            formula = double_negation(formula)
+            if formula.op in ATOMS or formula.op == 'NEGATION' and formula.a.op in ATOMS:
+                counts['closure_checks'] += 1
+        self.emit(rule, node, detail)
+        if branch.closed:
+            counts['branches_closed'] += 1
+            self.emit('closed', branch.clash)
+
+    # the beta rule split node into children, one formula each
+    def split(self, node, formulas, children):
+        counts = self.counts
+        counts['beta'] += 1
+        counts['branches_opened'] += len(children)
+        self.emit('beta', node, len(children))
+        for formula, child in zip(formulas, children):
+            formula = double_negation(formula)
+            if formula.op in ATOMS or formula.op == 'NEGATION' and formula.a.op in ATOMS:
+                counts['closure_checks'] += 1
+            if child.closed:
+                counts['branches_closed'] += 1
+                self.emit('closed', child.clash)
+
+    def introduced(self, constant):
+        self.counts['constants'] += 1
+        self.emit('constant', None, constant)
+
+    def set_aside(self):
+        self.counts['set_aside'] += 1
+        self.emit('set_aside')
+
+# the events of a log written by a Probe
+def read_events(lines):
+    import json
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+# fold events into flame graph input, 'is_satisfiable;event;formula weight'
+# lines with the microseconds spent on each (event, formula), heaviest first
+def flame_summary(events):
+    totals = {}
+    for event in events:
+        frames = ['is_satisfiable', event['e']]
+        if event.get('n') is not None:
+            frames.append(event['n'])
+        key = ';'.join(frames)
+        totals[key] = totals.get(key, 0) + event['us']
+    return ['%s %d' % (key, weight) for key, weight in sorted(totals.items(), key=lambda item: (-item[1], item[0]))]
+
+# python3 tableau.py --profile FORMULA [--schedule S] [--max-steps N] [--max-seconds S]
+#                              [--trace-file PATH] [--top N]
+# python3 tableau.py --profile --replay PATH [--top N]
+# checks FORMULA and prints the answer and the counters; with a trace file
+# the event log is kept there and its heaviest flame lines printed too.
+# --replay only folds an existing log
+def profile_main(argv):
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(prog='tableau.py --profile')
+    parser.add_argument('formula', nargs='?', default=None)
+    parser.add_argument('--schedule', default='dfs', choices=sorted(SCHEDULERS))
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('--trace-file', default=None)
+    parser.add_argument('--replay', default=None)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+    out = sys.stdout
+    if args.replay is None:
+        if args.formula is None:
+            parser.error('a formula or --replay is needed')
+        log = None if args.trace_file is None else open(args.trace_file, 'w')
+        try:
+            probe = Probe(log)
+            result = sat([theory(args.formula)], args.schedule, Budget(args.max_steps, None, None, args.max_seconds),
+                         probe=probe)
+        finally:
+            if log is not None:
+                log.close()
+        out.write('%s %s.\n' % (args.formula, SAT_OUTPUTS[result]))
+        for counter in PROBE_COUNTERS:
+            out.write('%s %d\n' % (counter, probe.counts[counter]))
+        if args.trace_file is None:
+            return
+    with open(args.replay or args.trace_file) as stream:
+        for line in flame_summary(read_events(stream))[:args.top]:
+            out.write(line + '\n')
+
+def is_satisfiable(tableau, schedule='dfs', budget=None, witness=False, probe=None, branches=None, leftover=None,
+                   kept=None):
+    # way this is structured:
+    # every branch keeps its own constants, starting with the names free in
+    # the input (they name elements of the domain too) and growing by a fresh
+    # constant per delta step; a branch that would need more than
+    # max_constants of its own is given up on and the search carries on with
+    # the others, so the answer is only 2 if no other branch is open (or
+    # more than MAX_SET_ASIDE branches have been given up on)
+    # the search can also carry on from open branches of an earlier one
+    # instead of starting at the root (the last of them is expanded first
+    # with dfs), and when the budget stops it the branches still open are
+    # put on leftover if it is a list, the one it would have expanded next
+    # first (see the parallel search)
+    # with kept a list, branches set aside are put on it (keeping the
+    # existential they could not expand) and so is the open branch the
+    # search stops at, whose unexpanded siblings go on leftover as the
+    # budget would put them, so more formulas can be added to all of them
+    # later (see Theory)
+    # unless a proof is wanted, every branch that closes passes up the
+    # formulas its closing needed (see closed_on), so a split closed by
+    # formulas that were there before it drops its other sides, and the
+    # last MAX_LEMMAS sets of formulas that closed both sides of one are
+    # kept to close any branch holding all of them before it splits again
+    if schedule not in SCHEDULERS:
+        raise ValueError(f"unknown schedule {schedule!r}, expected one of {sorted(SCHEDULERS)}")
+    stck = SCHEDULERS[schedule]()
+
+    # budget checks only run once steps reaches next_check, so an unlimited
+    # search pays a single comparison per step
+    if budget is None:
+        budget = Budget()
+    max_constants = MAX_CONSTANTS if budget.max_constants is None else budget.max_constants
+    track = MAX_LEMMAS > 0 and not witness
+    regular = REGULAR
+    taken = tableau.nodes.free
+    steps = 0
+    created = 1
+    instances = 0
+    most_constants = 0
+    set_aside = 0
+    closed_by_lemma = 0
+    dropped = 0
+    # lemma (a frozenset of formula ids) -> id of the beta formula it is
+    # filed under, oldest first, and that id -> its lemmas
+    lemmas = {}
+    filed = {}
+    next_check = -1
+    clock = None
+    started = None
+    if budget.max_seconds is not None:
+        import time
+        clock = time.monotonic
+        started = clock()
+
+    # the answer plus what the search has done so far
+    def result(code, reason=None, found=None):
+        stats = {'steps': steps, 'branches': created, 'open_branches': len(stck),
+                 'constants': most_constants, 'instances': instances, 'set_aside': set_aside,
+                 'lemmas': closed_by_lemma, 'dropped': dropped}
+        if clock is not None:
+            stats['seconds'] = clock() - started
+        if probe is not None:
+            probe.emit('result', None, code)
+        return SatResult(code, reason, stats, found)
+
+    # the search gives up with 2, putting branch (if it is still open) and
+    # the ones waiting on leftover
+    def stopped(reason, branch=None):
+        out = result(2, reason)
+        if leftover is not None:
+            if branch is not None:
+                leftover.append(branch)
+            drain()
+        return out
+
+    # the branches still waiting go on leftover, less those that need not be expanded
+    def drain():
+        while stck:
+            waiting = stck.pop()
+            if not waiting.closed and not settled(waiting):
+                leftover.append(waiting)
+
+    # branch closed because the formulas whose ids are in core (by default
+    # its clash) cannot all hold: pass that up the splits above it, each
+    # time as the formulas they came from that were there before the split
+    # (everything a side put on is in its own premises). a split with a
+    # side that closed without the side's own formula closes on the same
+    # core, and one whose sides all closed on the union of theirs (the beta
+    # formula standing in for its sides), which is filed as a lemma
+    def closed_on(branch, core=None):
+        if core is None:
+            core = (branch.clash.id, make_formula('NEGATION', branch.clash).id)
+        split = branch.split
+        while split is not None and not split.done:
+            parent = split.branch
+            premises = branch.premises
+            lifted = set()
+            for key in core:
+                while key in premises:
+                    key = premises[key]
+                lifted.add(key)
+            if len(lifted) > LEMMA_SIZE:
+                return
+            if split.node.id in lifted:
+                split.core |= lifted
+                split.waiting -= 1
+                if split.waiting:
+                    return
+                lifted = split.core
+                remember(split.node, lifted)
+            split.done = True
+            branch = parent
+            core = lifted
+            split = parent.split
+
+    # file core under the beta formula node, forgetting the oldest lemma to make room
+    def remember(node, core):
+        core = frozenset(core)
+        if core in lemmas:
+            return
+        if len(lemmas) >= MAX_LEMMAS:
+            oldest = next(iter(lemmas))
+            filed[lemmas.pop(oldest)].remove(oldest)
+        lemmas[core] = node.id
+        filed.setdefault(node.id, []).append(core)
+
+    # a lemma filed under the beta formula node that branch holds all of, or None
+    def known(branch, node):
+        for core in filed.get(node.id, ()):
+            if all(key == node.id or branch.has(formula_by_id(key)) for key in core):
+                return core
+        return None
+
+    # a fresh constant for branch, None if it has used up max_constants
+    def new_constant(branch):
+        if branch.introduced >= max_constants:
+            return None
+        name = constant_name(branch.next_constant)
+        branch.next_constant += 1
+        while name in taken:
+            name = constant_name(branch.next_constant)
+            branch.next_constant += 1
+        branch.introduced += 1
+        return name
+
+    if probe is not None:
+        probe.emit('start', tableau.nodes)
+    if branches is None:
+        root = Branch()
+        if witness:
+            root.trace = []
+        for name in sorted(taken):
+            root.add_constant(name)
+        root.add(tableau.nodes)
+        branches = [] if root.closed else [root]
+    for branch in branches:
+        stck.push(branch)
     # start looping through all 
     while stck:
-        # print(f"USED_VARS", used_vars)
-        current_branch = stck.pop(0)
-        # print(f"Stck: {stck}")
-        # print(f"Current Branch: {current_branch}")
-        # check if current_branch is closed
-        if is_closed(current_branch):
-            # print("Branch is closed")
-            closed_branches += 1
-            continue
-        else:
-            # list of branches = list of lists of nodes
-            new_branches = []
-            # run expansion
-            for node in current_branch:
-                # print(len(available_vars))
-                if len(available_vars) == 0:
-                    return 2
-                node = clean_fol_formula(node)
-                # print(f"gamma_nodes", gamma_nodes)
-                # print(f"gamma_expanded_formulae", gamma_expanded_formulae)
-                # print(f"dealing with node: {node}")
-                # print(f"new_branches: {new_branches}")
-                # print(f"gamma_expanded_formulae: {gamma_expanded_formulae}")
-                # run through all expansions
-                node = double_negation(node)
+        branch = stck.pop()
+        if track and settled(branch):
+            dropped += 1
+            continue
+        # expand the branch until it closes, splits or runs out of formulas
+        while not branch.closed:
+            steps += 1
+            if steps >= next_check:
+                reason = budget_exceeded(budget, steps, clock, started)
+                if reason is not None:
+                    return stopped(reason, branch)
+                next_check = next_budget_check(budget, steps)
+
+            if branch.formulas:
+                premise = branch.pop_formula()
+                node = double_negation(clean_fol_formula(premise))
+                if node is not premise:
+                    if branch.trace is not None:
+                        branch.trace.append(('n', premise, None))
+                    branch.premises[node.id] = premise.id
                 alpha_expanded = alpha_expansion(node)
+                if alpha_expanded is not node:
+                    if branch.trace is not None:
+                        branch.trace.append(('a', node, None))
+                    for a in alpha_expanded:
+                        branch.add(a, node)
+                    if probe is not None:
+                        probe.applied('alpha', node, alpha_expanded, branch)
+                elif node.op == 'EXISTS':
+                    branch.add_existential(node)
+                elif node.op == 'FORALL':
+                    branch.add_universal(node, iter_stack(branch.constants))
+                else:
+                    # double negation removed, put back whatever is left
+                    branch.add(node)
+            elif branch.instances:
+                # one gamma instance nobody on this branch has added yet
+                universal, var = branch.pop_instance()
+                instances += 1
+                if branch.trace is not None:
+                    branch.trace.append(('g', universal, var))
+                gamma_expanded = gamma_expansion(universal, [var])
+                for g in gamma_expanded:
+                    branch.add(g, universal)
+                if probe is not None:
+                    probe.applied('gamma', universal, gamma_expanded, branch, var)
+            elif branch.betas:
+                node = branch.pop_beta()
                 beta_expanded = beta_expansion(node)
-                delta_expanded = delta_expansion(node, available_vars[0])
-                gamma_expanded = gamma_expansion(node, used_vars)
-                
-                # try alpha expansion first
-                if alpha_expanded != node:
-                    # print(f"new_branches: {new_branches}")
-                    # if alpha expansion was successful, add new nodes to new_branches
-                    # print(f"alpha_expanded: {alpha_expanded}")
-                    if len(new_branches) == 0:
-                        new_branches.append(alpha_expanded)
-                        # add gamma expansions 
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-                    elif len(new_branches) > 0:
-                        for branch in new_branches:
-                            for a in alpha_expanded:
-                                branch.append(a)
-                        # add gamma expansions 
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-                            
-                elif beta_expanded != node:
-                    # print(f"new_branches: {new_branches}")
-                    # if alpha expansion was not successful, try beta expansion
-                    beta_expanded = beta_expansion(node)
-                    # print(f"beta_expanded: {beta_expanded}")
-                    if len(new_branches) == 0:
-                        num_branches_at_end += 1
-                        # print("new_branches is empty")
-                        for b in beta_expanded:
-                            new_branches.append([b])
-                        # add gamma expansions    
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-                    elif len(new_branches) == 1:
-                        num_branches_at_end += 1
-                        # print("new_branches has one element")
-                        temp = new_branches.pop()
-                        for b in beta_expanded:
-                            new_branches.append([b])
-                        for branches in new_branches:
-                            branches.append(temp)
-                        # add gamma expansions    
-                        if gamma_expanded_formulae:                  
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-                    elif len(new_branches) == 2:
-                        # print("new_branches has two elements")
-                        for branches in new_branches:
-                            branches.append(node)
-                        # add gamma expansions    
-                        if gamma_expanded_formulae:  
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-
-                elif delta_expanded != node:
-                    # print(f"delta_expanded: {delta_expanded}")
-                    # print(f"available_vars: {available_vars}")
-                    delta_expanded = delta_expansion(node, available_vars[0])
-                    used_vars.append(available_vars[0])
-                    # add in gamma expansions for this new variable
-                    if gamma_nodes:
-                        for g in gamma_nodes:
-                            gamma_expanded_formulae.append((gamma_expansion(g, [available_vars[0]]))[0])
-                    available_vars.pop(0)
-                    
-                    if len(new_branches) == 0:
-                        # print("new_branches is empty")
-                        # print(f"delta_expanded: {delta_expanded}")
-                        new_branches.append([delta_expanded])
-                        # add gamma expansions    
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    # print(f"branches: {branches}")
-                                    branches.append(g)
-                    elif len(new_branches) > 0:
-                        for branch in new_branches:
-                            branch.append(delta_expanded)
-                        # add gamma expansions    
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-
-                elif gamma_expanded != node:
-                    # special case here! if it is gamma_expanded, it must continuously be brought down
-                    # and always be expanded 
-                    # print(f"gamma_expanded: {gamma_expanded}")
-                    gamma_expanded = gamma_expansion(node, used_vars)
-                    # add gamma node to gamma_nodes to be added to each branch later as well
-                    gamma_nodes.append(node)
-                    # also add current gamma_expanded to gamma_expanded_formulae
-                    for g in gamma_expanded:
-                        gamma_expanded_formulae.append(g)
-                    # gamma_expanded is a list of nodes that should be added
-                    if len(new_branches) == 0:
-                        # print("new_branches is empty")
-                        for g in gamma_expanded:
-                            new_branches.append([g])
-                        # add gamma expansions 
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-                    elif len(new_branches) > 0:
-                        # print("new_branches has more than 0 elements")
-                        for branches in new_branches:
-                            for g in gamma_expanded:
-                                branches.append(g)
-                        # add gamma expansions  
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
+                if regular and any(branch.has(formula) for formula in beta_expanded):
+                    # a side already on the branch makes node hold as well
+                    continue
+                if track:
+                    core = known(branch, node)
+                    if core is not None:
+                        closed_by_lemma += 1
+                        branch.closed = True
+                        closed_on(branch, core)
+                        break
+                # both children share this branch and only record their own side
+                split = Split(branch, node, len(beta_expanded)) if track else None
+                children = []
+                for formula in beta_expanded:
+                    child = Branch(branch)
+                    child.split = split
+                    if branch.trace is not None:
+                        child.trace = []
+                    child.add(formula, node)
+                    children.append(child)
+                    created += 1
+                    if not child.closed:
+                        stck.push(child)
+                    elif track:
+                        closed_on(child)
+                if branch.trace is not None:
+                    branch.trace.append(('b', node, children))
+                if probe is not None:
+                    probe.split(node, beta_expanded, children)
+                if budget.max_branches is not None and len(stck) > budget.max_branches:
+                    return stopped('branches')
+                break
+            elif branch.existentials != EMPTY_QUEUE:
+                node = branch.pop_existential()
+                var = new_constant(branch)
+                if var is None:
+                    set_aside += 1
+                    if probe is not None:
+                        probe.set_aside()
+                    if kept is not None:
+                        branch.add_existential(node)
+                        kept.append(branch)
+                    if set_aside > MAX_SET_ASIDE:
+                        return stopped('constants')
+                    break
+                most_constants = max(most_constants, branch.introduced)
+                if branch.trace is not None:
+                    branch.trace.append(('d', node, var))
+                delta_expanded = delta_expansion(node, var)
+                branch.add(delta_expanded, node)
+                # the universals already on the branch also hold for the new constant
+                branch.add_constant(var)
+                if probe is not None:
+                    probe.introduced(var)
+                    probe.applied('delta', node, (delta_expanded,), branch, var)
+            elif branch.universals and branch.constants is None:
+                # the domain is never empty, so instantiate with a first constant
+                var = new_constant(branch)
+                if var is None:
+                    set_aside += 1
+                    if probe is not None:
+                        probe.set_aside()
+                    if kept is not None:
+                        kept.append(branch)
+                    if set_aside > MAX_SET_ASIDE:
+                        return stopped('constants')
+                    break
+                most_constants = max(most_constants, branch.introduced)
+                branch.add_constant(var)
+                if probe is not None:
+                    probe.introduced(var)
+            else:
+                # fully expanded and still open, no need to look any further
+                if probe is not None:
+                    probe.emit('open')
+                if kept is not None:
+                    kept.append(branch)
+                    if leftover is not None:
+                        drain()
+                if witness:
+                    return result(1, None, branch_model(branch, tableau.nodes))
+                return result(1)
+        if track and branch.closed and branch.clash is not None:
+            closed_on(branch)
 
-                else:
-                    # if alpha and beta were not successful, node must be a literal or predicate, so carry these down
-                    # print("literal detected!")
-                    if len(new_branches) == 0:
-                        literals_to_handle.append(node)
-                        # add gamma expansions  
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-                    elif len(new_branches) > 0:
-                        for branch in new_branches:
-                            branch.append(node)
-                        # add gamma expansions    
-                        if gamma_expanded_formulae:
-                            for branches in new_branches:
-                                for g in gamma_expanded_formulae:
-                                    branches.append(g)
-
-            # add literals to all branches  
-            for branch in new_branches:
-                for literal in literals_to_handle:
-                    branch.append(literal)
-            
-            # nuke gamma_expanded_formulae
-            gamma_expanded_formulae = []       
-            # nuke literals_to_handle
-            literals_to_handle = []
-            # add new nodes to current_branch
-            # print(f"new_branches AT END: {new_branches}")
-            stck += new_branches
-        
-    # print(f"num_branches_at_end: {num_branches_at_end + 1}")
-    # print(f"closed_branches: {closed_branches}")
-    if closed_branches == num_branches_at_end + 1:
-        return 0
-    else:
-        return 1
+    # every branch closed, or the ones left open needed too many constants
+    if set_aside:
+        return result(2, 'constants')
+    if witness:
+        return result(0, None, tableau_proof(root, tableau.nodes))
+    return result(0)
 
-# You may choose to represent a theory as a set or a list
-def theory(fmla):
-    return TableauNode(parse_formula(lexer(fmla)))
-    
-# check for satisfiability
-def sat(tableau):
-    # output 0 if not satisfiable, output 1 if satisfiable, output 2 if the number of constants exceeds MAX_CONSTANTS
-    out = is_satisfiable(tableau[0])
-    return out
-############################################################################################################
+###### parallel search
 
-#DO NOT MODIFY THE CODE BELOW
-f = open('input.txt')
+# steps a worker spends on the branches it was given before it hands the
+# ones still open back, so that workers which ran out of work can take them
+PARALLEL_QUANTUM = 20000
 
-parseOutputs = ['not a formula',
-                'an atom',
-                'a negation of a first order logic formula',
-                'a universally quantified formula',
-                'an existentially quantified formula',
-                'a binary connective first order formula',
-                'a proposition',
-                'a negation of a propositional formula',
-                'a binary connective propositional formula']
+# the items of a persistent queue, oldest first
+def queue_items(queue):
+    front, back = queue
+    return list(iter_stack(front)) + list(iter_stack(back))[::-1]
 
-satOutput = ['is not satisfiable', 'is satisfiable', 'may or may not be satisfiable']
+# a (node, rest) stack with items[0] on top
+def stack_of(items):
+    stack = None
+    for item in reversed(items):
+        stack = (item, stack)
+    return stack
 
+# a branch flattened into tuples of formulas, constants and numbers, which
+# pickle (formulas are interned again on arrival) while Branch segments,
+# their parents and the atom ids in them belong to one process: the
+# literals on the branch, its stacks top first and queue oldest first, the
+# universals and instances it has seen and its constants
+def branch_state(branch):
+    positive = []
+    negative = []
+    instantiated = []
+    segment = branch
+    while segment is not None:
+        positive += [formula_by_id(atom) for atom in segment.positive]
+        negative += [formula_by_id(atom) for atom in segment.negative]
+        instantiated += segment.instantiated
+        segment = segment.parent
+    return (tuple(positive), tuple(negative), tuple(iter_stack(branch.formulas)), tuple(iter_stack(branch.betas)),
+            tuple(iter_stack(branch.universals)), tuple(queue_items(branch.existentials)),
+            tuple(iter_stack(branch.instances)), tuple(instantiated), tuple(iter_stack(branch.constants)),
+            branch.introduced, branch.next_constant)
 
+# the open branch a branch_state was taken from, as a single segment
+def branch_from_state(state):
+    (positive, negative, formulas, betas, universals, existentials, instances, instantiated, constants,
+     introduced, next_constant) = state
+    branch = Branch()
+    branch.positive = set(atom.id for atom in positive)
+    branch.negative = set(atom.id for atom in negative)
+    branch.formulas = stack_of(formulas)
+    branch.betas = stack_of(betas)
+    branch.universals = stack_of(universals)
+    for node in existentials:
+        branch.existentials = queue_push(branch.existentials, node)
+    branch.instances = stack_of(instances)
+    branch.instantiated = set(instantiated)
+    branch.constants = stack_of(constants)
+    branch.introduced = introduced
+    branch.next_constant = next_constant
+    branch.pending = len(formulas) + len(betas) + len(existentials) + len(instances)
+    return branch
 
-firstline = f.readline()
+# a branch_state in the binary format, for sending to another process:
+# the names it uses (a count, then each as a varint length and UTF-8),
+# then its parts in order, each a count followed by its formulas, all
+# sharing one node numbering so that the subformulas the parts have in
+# common are written once. instances are (formula, constant name) pairs,
+# instantiated entries a 0 byte and a formula or a 1 byte and such a pair,
+# and the state ends with the two numbers
+def encode_branch(state):
+    (positive, negative, formulas, betas, universals, existentials, instances, instantiated, constants,
+     introduced, next_constant) = state
+    atoms = AtomTable()
+    numbers = {}
+    body = bytearray()
+    for part in (positive, negative, formulas, betas, universals, existentials):
+        write_varint(body, len(part))
+        for formula in part:
+            encode_formula(formula, body, atoms, numbers)
+    write_varint(body, len(instances))
+    for universal, constant in instances:
+        encode_formula(universal, body, atoms, numbers)
+        write_varint(body, atoms.number(constant))
+    write_varint(body, len(instantiated))
+    for key in instantiated:
+        if isinstance(key, Formula):
+            body.append(0)
+            encode_formula(key, body, atoms, numbers)
+        else:
+            body.append(1)
+            encode_formula(key[0], body, atoms, numbers)
+            write_varint(body, atoms.number(key[1]))
+    write_varint(body, len(constants))
+    for constant in constants:
+        write_varint(body, atoms.number(constant))
+    write_varint(body, introduced)
+    write_varint(body, next_constant)
+    out = bytearray()
+    write_varint(out, len(atoms.names))
+    for name in atoms.names:
+        data = name.encode('utf-8')
+        write_varint(out, len(data))
+        out += data
+    return bytes(out + body)
 
-PARSE = False
-if 'PARSE' in firstline:
-    PARSE = True
+# the branch_state encode_branch wrote to buffer
+def decode_branch(buffer):
+    names = []
+    count, i = read_varint(buffer, 0)
+    for _ in range(count):
+        length, i = read_varint(buffer, i)
+        names.append(bytes(buffer[i:i + length]).decode('utf-8'))
+        i += length
+    nodes = []
+    parts = []
+    for _ in range(6):
+        count, i = read_varint(buffer, i)
+        part = []
+        for _ in range(count):
+            formula, i = decode_formula(buffer, i, names, nodes)
+            part.append(formula)
+        parts.append(tuple(part))
+    instances = []
+    count, i = read_varint(buffer, i)
+    for _ in range(count):
+        universal, i = decode_formula(buffer, i, names, nodes)
+        constant, i = read_varint(buffer, i)
+        instances.append((universal, names[constant]))
+    instantiated = []
+    count, i = read_varint(buffer, i)
+    for _ in range(count):
+        pair = buffer[i]
+        key, i = decode_formula(buffer, i + 1, names, nodes)
+        if pair:
+            constant, i = read_varint(buffer, i)
+            key = (key, names[constant])
+        instantiated.append(key)
+    constants = []
+    count, i = read_varint(buffer, i)
+    for _ in range(count):
+        constant, i = read_varint(buffer, i)
+        constants.append(names[constant])
+    introduced, i = read_varint(buffer, i)
+    next_constant, i = read_varint(buffer, i)
+    return tuple(parts) + (tuple(instances), tuple(instantiated), tuple(constants), introduced, next_constant)
 
-SAT = False
-if 'SAT' in firstline:
-    SAT = True
+# made by parallel_is_satisfiable before its workers are forked, so every
+# worker shares it, and set once the answer is known
+_CANCEL = None
 
-for line in f:
-    if line[-1] == '\n':
-        line = line[:-1]
-    parsed = parse(line)
+# run in a worker: search on from the branches in states (encode_branch
+# bytes) for at most budget.max_steps steps; returns the answer, why it is
+# undetermined, the stats, and the encoded branches left open when the
+# steps ran out
+def explore_branches(tableau, states, schedule, budget):
+    budget.cancel = _CANCEL
+    leftover = []
+    branches = [branch_from_state(decode_branch(state)) for state in reversed(states)]
+    out = is_satisfiable(tableau, schedule, budget, branches=branches, leftover=leftover)
+    return int(out), out.reason, out.stats, [encode_branch(branch_state(branch)) for branch in leftover]
 
-    if PARSE:
-        output = "%s is %s." % (line, parseOutputs[parsed])
-        if parsed in [5,8]:
-            output += " Its left hand side is %s, its connective is %s, and its right hand side is %s." % (lhs(line), con(line) ,rhs(line))
-        print(output)
+# is_satisfiable for one formula on several processes: the tableau is
+# grown breadth first here until there is an open branch for every worker,
+# then the open branches are shared out among the workers, each of which
+# searches its own for PARALLEL_QUANTUM steps and sends back the ones still
+# open, so a worker that is done takes over part of a busy one's work.
+# the first open saturated branch cancels everything else. the budget
+# holds for the whole search, except max_branches and max_memory which
+# hold for each piece of it; workers=None means one per CPU
+def parallel_is_satisfiable(tableau, schedule='dfs', budget=None, workers=None, quantum=PARALLEL_QUANTUM):
+    global _CANCEL
+    import multiprocessing
+    import time
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    if schedule not in SCHEDULERS:
+        raise ValueError(f"unknown schedule {schedule!r}, expected one of {sorted(SCHEDULERS)}")
+    if budget is None:
+        budget = Budget()
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    started = time.monotonic()
+    totals = {'steps': 0, 'branches': 0, 'open_branches': 0, 'constants': 0, 'instances': 0, 'set_aside': 0,
+              'lemmas': 0, 'dropped': 0, 'workers': workers, 'tasks': 0}
 
-    if SAT:
-        if parsed:
-            tableau = [theory(line)]
-            print('%s %s.' % (line, satOutput[sat(tableau)]))
+    # one piece of the search is done, False if it ran past the budget
+    def add(stats):
+        for key in ('steps', 'branches', 'instances', 'set_aside', 'lemmas', 'dropped'):
+            totals[key] += stats[key]
+        totals['constants'] = max(totals['constants'], stats['constants'])
+        totals['tasks'] += 1
+        return not (budget.max_steps is not None and totals['steps'] > budget.max_steps
+                    or budget.max_seconds is not None and time.monotonic() - started > budget.max_seconds)
+
+    # the budget of the next piece of the search
+    def piece(steps):
+        if budget.max_steps is not None:
+            steps = max(1, min(steps, budget.max_steps - totals['steps']))
+        seconds = None
+        if budget.max_seconds is not None:
+            seconds = max(0.0, budget.max_seconds - (time.monotonic() - started))
+        return Budget(steps, budget.max_branches, budget.max_memory, seconds, budget.max_constants)
+
+    def result(code, reason=None, open_branches=0):
+        totals['open_branches'] = open_branches
+        totals['seconds'] = time.monotonic() - started
+        return SatResult(code, reason, totals)
+
+    # breadth first in this process, a few steps at a time, until every
+    # worker can have a branch
+    frontier = None
+    while True:
+        leftover = []
+        out = is_satisfiable(tableau, 'bfs', piece(BUDGET_CHECK_INTERVAL), branches=frontier, leftover=leftover)
+        within = add(out.stats)
+        if out.reason == 'time' or not within:
+            return result(2, 'time' if out.reason == 'time' else 'steps', len(leftover))
+        if totals['set_aside'] > MAX_SET_ASIDE:
+            return result(2, 'constants')
+        if out.reason != 'steps':
+            # branches an earlier piece set aside are still open
+            if out == 0 and totals['set_aside']:
+                return result(2, 'constants')
+            return result(int(out), out.reason, out.stats['open_branches'])
+        frontier = leftover[::-1]
+        if len(frontier) >= workers:
+            break
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    queue = [encode_branch(branch_state(branch)) for branch in reversed(frontier)]
+    _CANCEL = context.Event()
+    running = set()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        try:
+            while queue or running:
+                # share the queue out evenly among the idle workers
+                while queue and len(running) < workers:
+                    take = -(-len(queue) // (workers - len(running)))
+                    states = queue[:take]
+                    del queue[:take]
+                    running.add(executor.submit(explore_branches, tableau, states, schedule, piece(quantum)))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    code, reason, stats, states = future.result()
+                    within = add(stats)
+                    if code == 1:
+                        return result(1)
+                    if reason in ('time', 'memory', 'branches') or not within:
+                        return result(2, reason if reason in ('time', 'memory', 'branches') else 'steps',
+                                      len(queue) + len(states))
+                    if totals['set_aside'] > MAX_SET_ASIDE:
+                        return result(2, 'constants')
+                    queue += states
+        finally:
+            # the workers still searching stop at their next budget check,
+            # before the executor waits for them
+            _CANCEL.set()
+            for future in running:
+                future.cancel()
+    # every branch closed, or the ones left open needed too many constants
+    if totals['set_aside']:
+        return result(2, 'constants')
+    return result(0)
+
+###### free-variable tableau
+
+# a second engine for first-order formulas. the gamma rule above grounds a
+# universal over every constant on the branch and a branch only closes on
+# the exact complementary pair, so formulas that need many constants run
+# into MAX_CONSTANTS. here a universal is instantiated with a fresh free
+# variable instead, a branch closes on any two complementary atoms that
+# can be unified, and existentials are replaced by Skolem terms up front.
+# closing a branch binds variables the other branches share, so the search
+# backtracks over the ways of closing each branch; it is repeated with 1,
+# 2, ... up to max_depth gamma steps per branch (iterative deepening), so
+# every closed tableau within that bound is found.
+#
+# formulas are turned into nested tuples once:
+#   ('and', A, B), ('or', A, B), ('all', placeholder, A), ('true',),
+#   ('false',) and ('lit', positive, predicate, args), predicate None for a
+#   variable standing on its own as an atom
+# terms are ints for free variables, (symbol, args) for constants, which
+# have no args, and Skolem functions, and the placeholder strings of the
+# universals they are inside, replaced by a free variable when the
+# universal is instantiated
+
+# gamma steps allowed on one branch in the last round of deepening
+MAX_GAMMA_DEPTH = 6
+
+# the nested tuples for a formula in negation normal form, with every
+# existential replaced by a Skolem term over the universals around it
+def skolemize(formula):
+    done = []
+    skolems = 0
+    universals = 0
+    stack = [(formula, {})]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            # both sides of a connective are done
+            right = done.pop()
+            done.append((item, done.pop(), right))
+            node = None
+            op = None
+        else:
+            node, scope = item
+            op = node.op
+        if op is None:
+            pass
+        elif op == 'CONJUNCTION' or op == 'DISJUNCTION':
+            stack.append('and' if op == 'CONJUNCTION' else 'or')
+            stack.append((node.b, scope))
+            stack.append((node.a, scope))
+        elif op == 'FORALL':
+            universals += 1
+            placeholder = '?%d' % universals
+            inner = dict(scope)
+            inner[node.a] = placeholder
+            stack.append(('all', placeholder))
+            stack.append((node.b, inner))
+        elif op == 'EXISTS':
+            skolems += 1
+            inner = dict(scope)
+            inner[node.a] = ('sk%d' % skolems, term_placeholders([scope_term(scope, name) for name in sorted(node.free)]))
+            stack.append((node.b, inner))
+        elif op in TRUTH_CONSTANTS:
+            done.append(('true',) if op == 'TRUE' else ('false',))
+        else:
+            positive = op != 'NEGATION'
+            if not positive:
+                node = node.a
+            if node.op == 'PRED':
+                done.append(('lit', positive, node.a, tuple(scope_term(scope, arg.a) for arg in node.b)))
+            elif node.op == 'FOL_VAR':
+                done.append(('lit', positive, None, (scope_term(scope, node.a),)))
+            else:
+                done.append(('lit', positive, node.a, ()))
+        # a finished universal takes the body just done
+        while stack and isinstance(stack[-1], tuple) and stack[-1][0] == 'all':
+            done.append(stack.pop() + (done.pop(),))
+    return done[0]
+
+# the term a variable name stands for: what the quantifier around it made
+# of it, or a constant if it is free in the whole formula
+def scope_term(scope, name):
+    term = scope.get(name)
+    if term is None:
+        return (name, ())
+    return term
+
+# the placeholders inside terms, in order of first occurrence, as the args
+# of a Skolem term: the value it stands for only depends on those
+def term_placeholders(terms):
+    found = []
+    stack = list(reversed(terms))
+    while stack:
+        term = stack.pop()
+        if isinstance(term, str):
+            if term not in found:
+                found.append(term)
+        else:
+            stack += reversed(term[1])
+    return tuple(found)
+
+# tree (a formula or a term) with placeholder replaced by term, rebuilding
+# only the tuples that contain it
+def instantiate(tree, placeholder, term):
+    built = {}
+    stack = [tree]
+    while stack:
+        node = stack[-1]
+        if id(node) in built:
+            stack.pop()
+            continue
+        missing = [part for part in node if isinstance(part, tuple) and id(part) not in built]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        parts = []
+        changed = False
+        for part in node:
+            if isinstance(part, tuple):
+                new = built[id(part)]
+            elif part == placeholder and isinstance(part, str):
+                new = term
+            else:
+                new = part
+            changed = changed or new is not part
+            parts.append(new)
+        built[id(node)] = tuple(parts) if changed else node
+    return built[id(tree)]
+
+# follow the bindings of substitution from a term to what it stands for
+def resolve(term, substitution):
+    while isinstance(term, int) and term in substitution:
+        term = substitution[term]
+    return term
+
+# does variable occur in term under substitution
+def occurs(variable, term, substitution):
+    stack = [term]
+    while stack:
+        term = resolve(stack.pop(), substitution)
+        if isinstance(term, int):
+            if term == variable:
+                return True
+        else:
+            stack += term[1]
+    return False
+
+# substitution extended so the terms of lefts and rights pairwise become the
+# same, None if they cannot; substitution itself if it needs no new binding.
+# bindings are kept triangular, a copy is made on the first new one
+def unify(lefts, rights, substitution):
+    extended = substitution
+    stack = list(zip(lefts, rights))
+    while stack:
+        left, right = stack.pop()
+        left = resolve(left, extended)
+        right = resolve(right, extended)
+        if left is right or left == right:
+            continue
+        if isinstance(right, int) and not isinstance(left, int):
+            left, right = right, left
+        if isinstance(left, int):
+            if occurs(left, right, extended):
+                return None
+            if extended is substitution:
+                extended = dict(substitution)
+            extended[left] = right
+        elif left[0] != right[0] or len(left[1]) != len(right[1]):
+            return None
         else:
-            print('%s is not a formula.' % line)
-            
\ No newline at end of file
+            stack += zip(left[1], right[1])
+    return extended
+
+# satisfiability of a first-order formula with the free-variable tableau:
+# 0 once the tableau closes, 1 if a branch is fully expanded without ever
+# meeting a universal, so its literals are ground and open, and 2 when
+# max_depth (MAX_GAMMA_DEPTH if None) or the budget runs out first
+def free_variable_sat(formula, budget=None, max_depth=None):
+    # a branch is (todo, universals, literals, gammas): todo and literals
+    # are (item, rest) stacks, universals the persistent queue of the ones
+    # to instantiate again, round robin, and gammas how many times the
+    # branch has done so. a state is (branches, substitution, variables),
+    # the branches still to close (item, rest) as a stack, the bindings made
+    # closing the ones before and the number of free variables given out;
+    # states are never changed, so every way of going on is simply pushed
+    # onto choices
+    if budget is None:
+        budget = Budget()
+    if max_depth is None:
+        max_depth = MAX_GAMMA_DEPTH
+    root = skolemize(negation_normal_form(formula))
+    steps = 0
+    closures = 0
+    depth = 0
+    next_check = -1
+    clock = None
+    started = None
+    if budget.max_seconds is not None:
+        import time
+        clock = time.monotonic
+        started = clock()
+
+    def result(code, reason=None):
+        stats = {'steps': steps, 'depth': depth, 'closures': closures}
+        if clock is not None:
+            stats['seconds'] = clock() - started
+        return SatResult(code, reason, stats)
+
+    for depth in range(1, max_depth + 1):
+        choices = [((((root, None), EMPTY_QUEUE, None, 0), None), {}, 0)]
+        while choices:
+            branches, substitution, variables = choices.pop()
+            while True:
+                steps += 1
+                if steps >= next_check:
+                    reason = budget_exceeded(budget, steps, clock, started)
+                    if reason is not None:
+                        return result(2, reason)
+                    next_check = next_budget_check(budget, steps)
+                if branches is None:
+                    return result(0)
+                (todo, universals, literals, gammas), rest = branches
+                if todo is not None:
+                    node, todo = todo
+                    kind = node[0]
+                    if kind == 'and':
+                        branches = ((node[1], (node[2], todo)), universals, literals, gammas), rest
+                    elif kind == 'or':
+                        branches = (((node[1], todo), universals, literals, gammas),
+                                    (((node[2], todo), universals, literals, gammas), rest))
+                    elif kind == 'all':
+                        branches = (todo, queue_push(universals, node), literals, gammas), rest
+                    elif kind == 'true':
+                        branches = (todo, universals, literals, gammas), rest
+                    elif kind == 'false':
+                        closures += 1
+                        branches = rest
+                    else:
+                        # close the branch against every complementary
+                        # literal that unifies, or carry on with it open
+                        ways = []
+                        for other in iter_stack(literals):
+                            if other[1] == node[1] or other[2] != node[2] or len(other[3]) != len(node[3]):
+                                continue
+                            unified = unify(node[3], other[3], substitution)
+                            if unified is substitution:
+                                # closes without binding anything, nothing
+                                # else can do better
+                                ways = None
+                                break
+                            if unified is not None:
+                                ways.append(unified)
+                        if ways is None:
+                            closures += 1
+                            branches = rest
+                            continue
+                        opened = ((todo, universals, (node, literals), gammas), rest)
+                        if not ways:
+                            branches = opened
+                            continue
+                        choices.append((opened, substitution, variables))
+                        for unified in reversed(ways):
+                            choices.append((rest, unified, variables))
+                        closures += 1
+                        break
+                elif universals != EMPTY_QUEUE:
+                    if gammas >= depth:
+                        # this way of closing needs a deeper search
+                        break
+                    universal, universals = queue_pop(universals)
+                    body = instantiate(universal[2], universal[1], variables)
+                    branches = ((body, None), queue_push(universals, universal), literals, gammas + 1), rest
+                    variables += 1
+                else:
+                    # open, fully expanded and ground
+                    return result(1)
+    return result(2, 'depth')
+
+###### finite models
+
+# a third engine, for the first-order formulas the tableau gives up on
+# because an open branch would need more than MAX_CONSTANTS constants:
+# instead of building a branch it looks for a model directly, over domains
+# of 1, 2, ... up to max_size elements. the names free in the formula are
+# the first elements and the others get fresh constant names; there is no
+# equality, so giving every name an element of its own loses no models.
+# each predicate is an array of booleans with an axis per argument (an
+# n x n matrix for the binary ones), filled in a cell at a time with
+# backtracking. after every cell the formula is evaluated three-valued, as
+# what is certainly true and what is possibly true given the cells so far,
+# so a choice that already makes it false is taken back at once and one
+# that already makes it true is a model (the cells not yet filled in are
+# false). with NumPy every variable bound in the formula is an axis of its
+# own, so a quantifier is a single all or any along it; without NumPy the
+# same evaluation runs over Python lists.
+# the elements without a name are interchangeable, so only fillings in
+# which their diagonals (P(e, e) for each letter P in order) never
+# decrease from one element to the next are tried; every model can be put
+# in that order by renaming them
+
+# cells the search fills in before it gives up when the budget sets no
+# max_steps, as formulas whose models are all infinite would keep it going
+# through ever larger domains
+MAX_MODEL_STEPS = 10000
+
+# the instruction model_program ends each connective and quantifier with
+MODEL_OPCODES = {'NEGATION': 'not', 'CONJUNCTION': 'and', 'DISJUNCTION': 'or', 'IMPLICATION': 'imp',
+                 'FORALL': 'all', 'EXISTS': 'any'}
+
+# formula as a program for model_values, each instruction (op, a, b) in
+# postfix order: ('pred', letter, args) with args the element indexes of
+# the constants and -1 - k for the variable bound by the kth quantifier
+# around it, ('const', value, None), ('not', None, None), ('and', ...),
+# ('or', ...) and ('imp', ...), then ('all', k, None) and ('any', k, None)
+# for the quantifiers. returns (program, axes, arities), axes being how
+# deep quantifiers nest and arities the letters' numbers of arguments, or
+# None when the formula has atoms other than predicates
+def model_program(formula, elements):
+    program = []
+    arities = {}
+    axes = 0
+    stack = [(formula, {}, 0, False)]
+    while stack:
+        node, bound, depth, done = stack.pop()
+        op = node.op
+        if done:
+            program.append((MODEL_OPCODES[op], depth if op in QUANTIFIER_DUALS else None, None))
+        elif op == 'PRED':
+            args = tuple(-1 - bound[arg.a] if arg.a in bound else elements[arg.a] for arg in node.b)
+            arities[node.a] = len(args)
+            program.append(('pred', node.a, args))
+        elif op in TRUTH_CONSTANTS:
+            program.append(('const', op == 'TRUE', None))
+        elif op == 'NEGATION':
+            stack.append((node, bound, depth, True))
+            stack.append((node.a, bound, depth, False))
+        elif op in CONNECTIVE_SYMBOLS:
+            stack.append((node, bound, depth, True))
+            stack.append((node.b, bound, depth, False))
+            stack.append((node.a, bound, depth, False))
+        elif op in QUANTIFIER_DUALS:
+            inner = dict(bound)
+            inner[node.a] = depth
+            axes = max(axes, depth + 1)
+            stack.append((node, bound, depth, True))
+            stack.append((node.b, inner, depth + 1, False))
+        else:
+            return None
+    return program, axes, arities
+
+# the value of a program under a partial interpretation, as (certainly
+# true, possibly true): lower and upper map each letter to the NumPy array
+# of its cells that are certainly and possibly true, and axes holds the
+# index array of each bound variable, its values along its own axis
+def model_values(program, lower, upper, axes):
+    import numpy
+    stack = []
+    for op, a, b in program:
+        if op == 'pred':
+            index = tuple(axes[-1 - arg] if arg < 0 else arg for arg in b)
+            stack.append((lower[a][index], upper[a][index]))
+        elif op == 'const':
+            stack.append((a, a))
+        elif op == 'not':
+            low, high = stack.pop()
+            stack.append((numpy.logical_not(high), numpy.logical_not(low)))
+        elif op == 'all' or op == 'any':
+            reduce = numpy.all if op == 'all' else numpy.any
+            values = []
+            for value in stack.pop():
+                # a value that does not depend on the variable stays as it is
+                if numpy.ndim(value) > a:
+                    value = reduce(value, axis=a, keepdims=True)
+                values.append(value)
+            stack.append(tuple(values))
+        else:
+            low_b, high_b = stack.pop()
+            low_a, high_a = stack.pop()
+            if op == 'and':
+                stack.append((numpy.logical_and(low_a, low_b), numpy.logical_and(high_a, high_b)))
+            elif op == 'or':
+                stack.append((numpy.logical_or(low_a, low_b), numpy.logical_or(high_a, high_b)))
+            else:
+                stack.append((numpy.logical_or(numpy.logical_not(high_a), low_b),
+                              numpy.logical_or(numpy.logical_not(low_a), high_b)))
+    low, high = stack.pop()
+    return bool(numpy.all(low)), bool(numpy.all(high))
+
+# model_values without NumPy: cells maps (letter, args) to the value of
+# each cell filled in, and every value is a list over all the size ** axes
+# assignments to the bound variables, the kth variable's value being digit
+# k (most significant first) of the position in base size
+def model_values_python(program, cells, size, axes):
+    import itertools
+    points = list(itertools.product(range(size), repeat=axes))
+    stack = []
+    for op, a, b in program:
+        if op == 'pred':
+            low = []
+            high = []
+            for point in points:
+                value = cells.get((a, tuple(point[-1 - arg] if arg < 0 else arg for arg in b)))
+                low.append(value is True)
+                high.append(value is not False)
+            stack.append((low, high))
+        elif op == 'const':
+            stack.append(([a] * len(points), [a] * len(points)))
+        elif op == 'not':
+            low, high = stack.pop()
+            stack.append(([not value for value in high], [not value for value in low]))
+        elif op == 'all' or op == 'any':
+            reduce = all if op == 'all' else any
+            stride = size ** (axes - 1 - a)
+            values = []
+            for value in stack.pop():
+                reduced = []
+                for position in range(len(points)):
+                    first = position - position // stride % size * stride
+                    reduced.append(reduce(value[first + element * stride] for element in range(size)))
+                values.append(reduced)
+            stack.append(tuple(values))
+        else:
+            low_b, high_b = stack.pop()
+            low_a, high_a = stack.pop()
+            if op == 'and':
+                stack.append(([x and y for x, y in zip(low_a, low_b)], [x and y for x, y in zip(high_a, high_b)]))
+            elif op == 'or':
+                stack.append(([x or y for x, y in zip(low_a, low_b)], [x or y for x, y in zip(high_a, high_b)]))
+            else:
+                stack.append(([not x or y for x, y in zip(high_a, low_b)],
+                              [not x or y for x, y in zip(low_a, high_b)]))
+    low, high = stack.pop()
+    return low[0], high[0]
+
+# look for a model of formula with at most max_size elements (by default
+# max_constants of the budget, or MAX_CONSTANTS). the answer is 1, with
+# the Model as its witness, or 2: the reason is 'size' when there is no
+# model that small, 'atoms' for a formula with atoms that are not
+# predicates, or the budget's. steps counts the cells filled in
+def finite_model_sat(formula, budget=None, max_size=None):
+    import itertools
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if budget is None:
+        budget = Budget()
+    if budget.max_steps is None:
+        budget = Budget(MAX_MODEL_STEPS, budget.max_branches, budget.max_memory, budget.max_seconds,
+                        budget.max_constants, budget.cancel)
+    if max_size is None:
+        max_size = MAX_CONSTANTS if budget.max_constants is None else budget.max_constants
+    names = sorted(formula.free)
+    steps = 0
+    size = 0
+    next_check = -1
+    clock = None
+    started = None
+    if budget.max_seconds is not None:
+        import time
+        clock = time.monotonic
+        started = clock()
+
+    def result(code, reason=None, found=None):
+        stats = {'steps': steps, 'size': size}
+        if clock is not None:
+            stats['seconds'] = clock() - started
+        return SatResult(code, reason, stats, found)
+
+    compiled = model_program(formula, {name: element for element, name in enumerate(names)})
+    if compiled is None:
+        return result(2, 'atoms')
+    program, axes, arities = compiled
+    letters = sorted(arities)
+    for size in range(max(len(names), 1), max_size + 1):
+        # fresh names skip those the formula uses, as the delta rule's do
+        domain = list(names)
+        index = 0
+        while len(domain) < size:
+            name = constant_name(index)
+            index += 1
+            if name not in formula.free:
+                domain.append(name)
+        # the diagonals first, an element at a time, then the other cells
+        # by the largest element they mention; checks maps the position of
+        # the last diagonal cell of each unnamed element after the first to it
+        order = []
+        checks = {}
+        for element in range(size):
+            for letter in letters:
+                order.append((letter, (element,) * arities[letter]))
+            if element > len(names):
+                checks[len(order) - 1] = element
+        rest = []
+        for letter in letters:
+            for args in itertools.product(range(size), repeat=arities[letter]):
+                if len(set(args)) > 1:
+                    rest.append((max(args), args, letter))
+        order += [(letter, args) for _, args, letter in sorted(rest)]
+        cells = {}
+        if numpy is not None:
+            lower = {letter: numpy.zeros((size,) * arities[letter], dtype=bool) for letter in letters}
+            upper = {letter: numpy.ones((size,) * arities[letter], dtype=bool) for letter in letters}
+            grid = [numpy.arange(size).reshape([size if axis == k else 1 for axis in range(axes)])
+                    for k in range(axes)]
+
+        def evaluate():
+            if numpy is None:
+                return model_values_python(program, cells, size, axes)
+            return model_values(program, lower, upper, grid)
+
+        def fill(cell, value):
+            if value is None:
+                del cells[cell]
+            else:
+                cells[cell] = value
+            if numpy is not None:
+                letter, args = cell
+                lower[letter][args] = value is True
+                upper[letter][args] = value is not False
+
+        # with the cells up to position filled in, are the unnamed elements still in order
+        def ordered(position):
+            element = checks.get(position)
+            if element is None:
+                return True
+            before = tuple(cells[letter, (element - 1,) * arities[letter]] for letter in letters)
+            return before <= tuple(cells[letter, (element,) * arities[letter]] for letter in letters)
+
+        def model():
+            extensions = {}
+            for (letter, args), value in cells.items():
+                if value:
+                    extensions.setdefault(letter, []).append(tuple(domain[element] for element in args))
+            return Model(formula, sorted(domain), [], {letter: sorted(args) for letter, args in extensions.items()})
+
+        low, high = evaluate()
+        if low:
+            return result(1, None, model())
+        if not high:
+            continue
+        # values of the cells filled in so far, in order; value is the one
+        # to try next at the first cell not filled in, None once both failed
+        trail = []
+        value = False
+        while True:
+            if value is None:
+                if not trail:
+                    break
+                value = trail.pop()
+                fill(order[len(trail)], None)
+                value = True if value is False else None
+                continue
+            steps += 1
+            if steps >= next_check:
+                reason = budget_exceeded(budget, steps, clock, started)
+                if reason is not None:
+                    return result(2, reason)
+                next_check = next_budget_check(budget, steps)
+            cell = order[len(trail)]
+            fill(cell, value)
+            trail.append(value)
+            low, high = evaluate()
+            if high and ordered(len(trail) - 1):
+                if low:
+                    return result(1, None, model())
+                if len(trail) < len(order):
+                    value = False
+                    continue
+            trail.pop()
+            fill(cell, None)
+            value = True if value is False else None
+    return result(2, 'size')
+
+###### propositional fast path
+
+# true if the formula only uses propositional letters and connectives, so it
+# can go to the CDCL solver instead of the tableau
+def is_propositional(formula):
+    stack = [formula]
+    while stack:
+        node = stack.pop()
+        op = node.op
+        if op == 'PROP_VAR':
+            continue
+        elif op == 'NEGATION':
+            stack.append(node.a)
+        elif op in CONNECTIVE_SYMBOLS:
+            stack.append(node.a)
+            stack.append(node.b)
+        else:
+            return False
+    return True
+
+# CNF for a propositional formula by Tseitin encoding: every distinct
+# subformula (interning makes shared ones the same node) gets one variable
+# defined by clauses, negations just flip the sign. returns the clauses as
+# lists of non-zero ints (-v is the negation of v) and the number of variables.
+# literal_of, if given, is filled with the literal of every subformula
+def tseitin(formula, literal_of=None):
+    if literal_of is None:
+        literal_of = {}
+    clauses = []
+    count = 0
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in literal_of:
+            stack.pop()
+            continue
+        op = node.op
+        if op == 'PROP_VAR':
+            stack.pop()
+            count += 1
+            literal_of[node] = count
+            continue
+        children = (node.a,) if op == 'NEGATION' else (node.a, node.b)
+        missing = [child for child in children if child not in literal_of]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        if op == 'NEGATION':
+            literal_of[node] = -literal_of[node.a]
+            continue
+        a = literal_of[node.a]
+        b = literal_of[node.b]
+        count += 1
+        v = count
+        if op == 'CONJUNCTION':
+            clauses += ([-v, a], [-v, b], [v, -a, -b])
+        elif op == 'DISJUNCTION':
+            clauses += ([-v, a, b], [v, -a], [v, -b])
+        else:
+            clauses += ([-v, -a, b], [v, a], [v, -b])
+        literal_of[node] = v
+    clauses.append([literal_of[formula]])
+    return clauses, count
+
+# element x (from 0) of the Luby sequence 1 1 2 1 1 2 4 1 1 2 ... scaled by y
+def luby(y, x):
+    size = 1
+    seq = 0
+    while size < x + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != x:
+        size = (size - 1) >> 1
+        seq -= 1
+        x = x % size
+    return y ** seq
+
+# conflict driven clause learning over clauses on variables 1..num_vars:
+# two watched literals per clause, VSIDS variable activities kept in a lazy
+# heap, first-UIP learned clauses with non-chronological backjumping, phase
+# saving and restarts after RESTART_BASE times the Luby sequence conflicts
+class CDCLSolver:
+    RESTART_BASE = 100
+    ACTIVITY_DECAY = 0.95
+
+    def __init__(self, num_vars, clauses):
+        n = num_vars
+        self.num_vars = n
+        # value is 1, -1 or 0 for unassigned
+        self.value = [0] * (n + 1)
+        self.level = [0] * (n + 1)
+        self.reason = [None] * (n + 1)
+        self.phase = [False] * (n + 1)
+        self.activity = [0.0] * (n + 1)
+        self.seen = [False] * (n + 1)
+        # watches[2v] holds the clauses watching v, watches[2v + 1] those watching -v
+        self.watches = [[] for _ in range(2 * n + 2)]
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.increment = 1.0
+        self.heap = [(0.0, v) for v in range(1, n + 1)]
+        self.decisions = 0
+        self.conflicts = 0
+        self.learned = 0
+        # the learned clauses in order, ending with the empty clause when
+        # unsatisfiable, if set to a list before solve (see check_proof)
+        self.proof = None
+        self.ok = True
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def literal_value(self, literal):
+        if literal > 0:
+            return self.value[literal]
+        return -self.value[-literal]
+
+    def watch(self, literal, clause):
+        self.watches[2 * literal if literal > 0 else -2 * literal + 1].append(clause)
+
+    # add an input clause before solving starts
+    def add_clause(self, clause):
+        literals = []
+        for literal in clause:
+            if -literal in literals:
+                # tautology
+                return
+            if literal not in literals:
+                literals.append(literal)
+        if not literals:
+            self.ok = False
+        elif len(literals) == 1:
+            value = self.literal_value(literals[0])
+            if value == -1:
+                self.ok = False
+            elif value == 0:
+                self.assign(literals[0], None)
+        else:
+            self.watch(literals[0], literals)
+            self.watch(literals[1], literals)
+
+    def assign(self, literal, reason):
+        v = abs(literal)
+        self.value[v] = 1 if literal > 0 else -1
+        self.level[v] = len(self.trail_lim)
+        self.reason[v] = reason
+        self.trail.append(literal)
+
+    # unit propagation over the watches, returns a conflicting clause or None
+    def propagate(self):
+        value = self.value
+        trail = self.trail
+        watches = self.watches
+        while self.qhead < len(trail):
+            true_literal = trail[self.qhead]
+            self.qhead += 1
+            false_literal = -true_literal
+            watching = watches[2 * false_literal if false_literal > 0 else -2 * false_literal + 1]
+            i = 0
+            j = 0
+            n = len(watching)
+            while i < n:
+                clause = watching[i]
+                i += 1
+                if clause[0] == false_literal:
+                    clause[0] = clause[1]
+                    clause[1] = false_literal
+                first = clause[0]
+                first_value = value[first] if first > 0 else -value[-first]
+                if first_value == 1:
+                    watching[j] = clause
+                    j += 1
+                    continue
+                # look for a literal that is not false to watch instead
+                for k in range(2, len(clause)):
+                    other = clause[k]
+                    if (value[other] if other > 0 else -value[-other]) != -1:
+                        clause[1] = other
+                        clause[k] = false_literal
+                        self.watch(other, clause)
+                        break
+                else:
+                    watching[j] = clause
+                    j += 1
+                    if first_value == -1:
+                        while i < n:
+                            watching[j] = watching[i]
+                            j += 1
+                            i += 1
+                        del watching[j:]
+                        return clause
+                    self.assign(first, clause)
+            del watching[j:]
+        return None
+
+    def bump(self, v):
+        activity = self.activity
+        activity[v] += self.increment
+        if activity[v] > 1e100:
+            for u in range(1, self.num_vars + 1):
+                activity[u] *= 1e-100
+            self.increment *= 1e-100
+            self.heap = []
+            for u in range(1, self.num_vars + 1):
+                if self.value[u] == 0:
+                    heap_push(self.heap, (-activity[u], u))
+        elif self.value[v] == 0:
+            heap_push(self.heap, (-activity[v], v))
+
+    # first-UIP learned clause for a conflict, asserting literal first, and
+    # the level to jump back to
+    def analyze(self, conflict):
+        seen = self.seen
+        level = self.level
+        trail = self.trail
+        current = len(self.trail_lim)
+        learnt = [0]
+        counter = 0
+        literal = None
+        index = len(trail) - 1
+        clause = conflict
+        while True:
+            for other in (clause if literal is None else clause[1:]):
+                v = abs(other)
+                if not seen[v] and level[v] > 0:
+                    seen[v] = True
+                    self.bump(v)
+                    if level[v] >= current:
+                        counter += 1
+                    else:
+                        learnt.append(other)
+            while not seen[abs(trail[index])]:
+                index -= 1
+            literal = trail[index]
+            index -= 1
+            v = abs(literal)
+            seen[v] = False
+            counter -= 1
+            if counter == 0:
+                break
+            clause = self.reason[v]
+        learnt[0] = -literal
+        for other in learnt[1:]:
+            seen[abs(other)] = False
+        if len(learnt) == 1:
+            return learnt, 0
+        # the literal from the highest remaining level becomes the second watch
+        best = 1
+        for i in range(2, len(learnt)):
+            if level[abs(learnt[i])] > level[abs(learnt[best])]:
+                best = i
+        learnt[1], learnt[best] = learnt[best], learnt[1]
+        return learnt, level[abs(learnt[1])]
+
+    def backtrack(self, target):
+        if len(self.trail_lim) <= target:
+            return
+        start = self.trail_lim[target]
+        for literal in reversed(self.trail[start:]):
+            v = abs(literal)
+            self.phase[v] = literal > 0
+            self.value[v] = 0
+            self.reason[v] = None
+            heap_push(self.heap, (-self.activity[v], v))
+        del self.trail[start:]
+        del self.trail_lim[target:]
+        self.qhead = len(self.trail)
+
+    # the unassigned variable with the highest activity, None if all are set
+    def pick_branch_variable(self):
+        heap = self.heap
+        while heap:
+            activity, v = heap_pop(heap)
+            if self.value[v] == 0 and -activity == self.activity[v]:
+                return v
+        return None
+
+    def refuted(self):
+        if self.proof is not None:
+            self.proof.append([])
+        return False
+
+    # True if satisfiable, False if not, or the name of the budget limit
+    # that ran out first
+    def solve(self, budget=None):
+        if not self.ok or self.propagate() is not None:
+            return self.refuted()
+        if budget is None:
+            budget = Budget()
+        clock = None
+        started = None
+        if budget.max_seconds is not None:
+            import time
+            clock = time.monotonic
+            started = clock()
+        next_check = -1
+        restarts = 0
+        restart_at = luby(2, 0) * self.RESTART_BASE
+        since_restart = 0
+        while True:
+            steps = self.decisions + self.conflicts
+            if steps >= next_check:
+                reason = budget_exceeded(budget, steps, clock, started)
+                if reason is not None:
+                    return reason
+                next_check = next_budget_check(budget, steps)
+
+            conflict = self.propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                since_restart += 1
+                if not self.trail_lim:
+                    return self.refuted()
+                learnt, target = self.analyze(conflict)
+                if self.proof is not None:
+                    self.proof.append(list(learnt))
+                self.backtrack(target)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    self.watch(learnt[0], learnt)
+                    self.watch(learnt[1], learnt)
+                    self.learned += 1
+                    self.assign(learnt[0], learnt)
+                self.increment /= self.ACTIVITY_DECAY
+                if since_restart >= restart_at:
+                    self.backtrack(0)
+                    restarts += 1
+                    restart_at = luby(2, restarts) * self.RESTART_BASE
+                    since_restart = 0
+            else:
+                v = self.pick_branch_variable()
+                if v is None:
+                    return True
+                self.decisions += 1
+                self.trail_lim.append(len(self.trail))
+                self.assign(v if self.phase[v] else -v, None)
+
+# satisfiability of a propositional formula through Tseitin and CDCL, with
+# the same 0/1 answers as the tableau (2 only if the budget runs out); with
+# witness the result carries the satisfying valuation or the learned clauses
+def propositional_sat(formula, budget=None, witness=False):
+    literal_of = {}
+    clauses, num_vars = tseitin(formula, literal_of)
+    solver = CDCLSolver(num_vars, clauses)
+    if witness:
+        solver.proof = []
+    answer = solver.solve(budget)
+    stats = {'variables': num_vars, 'clauses': len(clauses), 'decisions': solver.decisions,
+             'conflicts': solver.conflicts, 'learned': solver.learned}
+    if answer is True:
+        found = None
+        if witness:
+            atoms = sorted(node.a for node, literal in literal_of.items()
+                           if node.op == 'PROP_VAR' and solver.value[literal] == 1)
+            found = Model(formula, [], atoms, {})
+        return SatResult(1, None, stats, found)
+    elif answer is False:
+        found = Proof('rup', formula, formula, solver.proof) if witness else None
+        return SatResult(0, None, stats, found)
+    return SatResult(2, answer, stats)
+
+# the parser only knows the letters p, q, r and s, so a propositional formula
+# has at most 16 valuations. valuation i (bit i of a mask) makes p true if
+# bit 3 of i is set, q bit 2, r bit 1 and s bit 0; a formula's truth mask has
+# bit i set if valuation i satisfies it and it is satisfiable iff it is non-zero
+ALL_VALUATIONS = 0xFFFF
+LETTER_MASKS = {'p': 0xFF00, 'q': 0xF0F0, 'r': 0xCCCC, 's': 0xAAAA}
+
+# truth mask of a propositional formula over p, q, r, s, None for anything
+# else. masks is a memo of already evaluated nodes that can be shared
+# between calls
+def truth_mask(formula, masks=None):
+    if masks is None:
+        masks = {}
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in masks:
+            stack.pop()
+            continue
+        op = node.op
+        if op == 'PROP_VAR':
+            stack.pop()
+            masks[node] = LETTER_MASKS.get(node.a)
+            continue
+        if op == 'NEGATION':
+            children = (node.a,)
+        elif op in CONNECTIVE_SYMBOLS:
+            children = (node.a, node.b)
+        else:
+            stack.pop()
+            masks[node] = None
+            continue
+        missing = [child for child in children if child not in masks]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        a = masks[node.a]
+        b = masks[children[-1]]
+        if a is None or b is None:
+            masks[node] = None
+        elif op == 'NEGATION':
+            masks[node] = ALL_VALUATIONS ^ a
+        elif op == 'CONJUNCTION':
+            masks[node] = a & b
+        elif op == 'DISJUNCTION':
+            masks[node] = a | b
+        else:
+            masks[node] = (ALL_VALUATIONS ^ a) | b
+    return masks[formula]
+
+TRUTH_OPCODES = {'NEGATION': 1, 'CONJUNCTION': 2, 'DISJUNCTION': 3, 'IMPLICATION': 4}
+
+# truth masks for a whole list of formulas (None entries and non-propositional
+# formulas give None). the distinct nodes of all of them are numbered children
+# first and grouped by height, then with NumPy every height is evaluated as one
+# vectorised step over uint16 masks; without NumPy the int version is used
+# with one memo shared by the batch
+def truth_masks(formulas):
+    try:
+        import numpy
+    except ImportError:
+        masks = {}
+        return [None if formula is None else truth_mask(formula, masks) for formula in formulas]
+
+    index = {}
+    ops = []
+    lefts = []
+    rights = []
+    heights = []
+    leaves = []
+    for formula in formulas:
+        if formula is None:
+            continue
+        stack = [formula]
+        while stack:
+            node = stack[-1]
+            if node in index:
+                stack.pop()
+                continue
+            op = node.op
+            if op == 'PROP_VAR':
+                stack.pop()
+                mask = LETTER_MASKS.get(node.a)
+                if mask is None:
+                    index[node] = None
+                else:
+                    index[node] = len(ops)
+                    ops.append(0)
+                    lefts.append(0)
+                    rights.append(0)
+                    heights.append(0)
+                    leaves.append(mask)
+                continue
+            if op not in TRUTH_OPCODES:
+                stack.pop()
+                index[node] = None
+                continue
+            children = (node.a,) if op == 'NEGATION' else (node.a, node.b)
+            missing = [child for child in children if child not in index]
+            if missing:
+                stack += missing
+                continue
+            stack.pop()
+            a = index[node.a]
+            b = index[children[-1]]
+            if a is None or b is None:
+                index[node] = None
+                continue
+            index[node] = len(ops)
+            ops.append(TRUTH_OPCODES[op])
+            lefts.append(a)
+            rights.append(b)
+            heights.append(max(heights[a], heights[b]) + 1)
+            leaves.append(0)
+
+    if ops:
+        values = numpy.array(leaves, dtype=numpy.uint16)
+        ops = numpy.array(ops, dtype=numpy.int8)
+        lefts = numpy.array(lefts, dtype=numpy.intp)
+        rights = numpy.array(rights, dtype=numpy.intp)
+        heights = numpy.array(heights, dtype=numpy.intp)
+        order = numpy.argsort(heights, kind='stable')
+        bounds = numpy.searchsorted(heights[order], numpy.arange(heights.max() + 2))
+        for height in range(1, len(bounds) - 1):
+            level = order[bounds[height]:bounds[height + 1]]
+            op = ops[level]
+            a = values[lefts[level]]
+            b = values[rights[level]]
+            values[level] = numpy.select([op == 1, op == 2, op == 3], [~a, a & b, a | b], ~a | b)
+        values = values.tolist()
+    results = []
+    for formula in formulas:
+        position = None if formula is None else index[formula]
+        results.append(None if position is None else values[position])
+    return results
+
+# 0/1 answer for a formula from its truth mask, counting the satisfying
+# valuations; given the formula, the result also carries a witness: the
+# first satisfying valuation, or a claim check_proof settles by evaluating
+def truth_table_sat(mask, formula=None):
+    found = None
+    if formula is not None:
+        if mask:
+            valuation = (mask & -mask).bit_length() - 1
+            letters = set()
+            stack = [formula]
+            while stack:
+                node = stack.pop()
+                if node.op == 'PROP_VAR':
+                    letters.add(node.a)
+                elif node.op == 'NEGATION':
+                    stack.append(node.a)
+                else:
+                    stack += (node.a, node.b)
+            atoms = sorted(letter for letter in letters if LETTER_MASKS[letter] >> valuation & 1)
+            found = Model(formula, [], atoms, {})
+        else:
+            found = Proof('truth-table', formula, formula, [])
+    return SatResult(1 if mask else 0, None, {'models': bin(mask).count('1')}, found)
+
+###### preprocessing
+
+# only preprocessing builds these: TRUE and FALSE nodes that keep the text
+# formula_to_string shows for them in a. simplify leaves either a formula
+# without them or one of them on its own
+TRUTH_CONSTANTS = ('TRUE', 'FALSE')
+
+QUANTIFIER_DUALS = {'FORALL': 'EXISTS', 'EXISTS': 'FORALL'}
+CONNECTIVE_DUALS = {'CONJUNCTION': 'DISJUNCTION', 'DISJUNCTION': 'CONJUNCTION'}
+
+def truth_constant(value):
+    if value:
+        return make_formula('TRUE', 'true')
+    return make_formula('FALSE', 'false')
+
+# number of nodes of the formula written out as a tree
+def formula_size(formula):
+    sizes = {}
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in sizes:
+            stack.pop()
+            continue
+        if node.op == 'NEGATION':
+            children = (node.a,)
+        elif node.op in QUANTIFIER_DUALS:
+            children = (node.b,)
+        elif node.op in CONNECTIVE_SYMBOLS:
+            children = (node.a, node.b)
+        else:
+            children = ()
+        missing = [child for child in children if child not in sizes]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        sizes[node] = 1 + sum(sizes[child] for child in children)
+    return sizes[formula]
+
+# the operands of a chain of the same connective, left to right, so
+# (A/\(B/\C)) and ((A/\B)/\C) both give [A, B, C]
+def chain_operands(node, op):
+    operands = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.op == op:
+            stack.append(node.b)
+            stack.append(node.a)
+        else:
+            operands.append(node)
+    return operands
+
+def build_chain(op, operands):
+    formula = operands[-1]
+    for operand in reversed(operands[:-1]):
+        formula = make_formula(op, operand, formula)
+    return formula
+
+# negation normal form: no implications, and negations only in front of
+# atoms, so the tableau never meets ~~, ~A, ~E or a negated connective
+def negation_normal_form(formula):
+    done = {}
+    stack = [(formula, False)]
+    while stack:
+        key = stack[-1]
+        if key in done:
+            stack.pop()
+            continue
+        node, negated = key
+        op = node.op
+        if op == 'NEGATION':
+            children = ((node.a, not negated),)
+        elif op in QUANTIFIER_DUALS:
+            children = ((node.b, negated),)
+        elif op == 'IMPLICATION':
+            children = ((node.a, not negated), (node.b, negated))
+        elif op in CONNECTIVE_DUALS:
+            children = ((node.a, negated), (node.b, negated))
+        else:
+            stack.pop()
+            if not negated:
+                done[key] = node
+            elif op in TRUTH_CONSTANTS:
+                done[key] = truth_constant(op == 'FALSE')
+            else:
+                done[key] = make_formula('NEGATION', node)
+            continue
+        missing = [child for child in children if child not in done]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        if op == 'NEGATION':
+            done[key] = done[children[0]]
+        elif op in QUANTIFIER_DUALS:
+            done[key] = make_formula(QUANTIFIER_DUALS[op] if negated else op, node.a, done[children[0]])
+        else:
+            if op == 'IMPLICATION':
+                op = 'DISJUNCTION'
+            if negated:
+                op = CONNECTIVE_DUALS[op]
+            done[key] = make_formula(op, done[children[0]], done[children[1]])
+    return done[(formula, False)]
+
+# one simplified /\ or \/ chain from already simplified operands: drops
+# neutral constants and repeated operands, becomes the absorbing constant if
+# it has one or a literal together with its negation, and drops operands
+# subsumed by another one (A/\(A\/B) is A, A\/(A/\B) is A)
+def simplify_chain(op, operands):
+    absorbing = 'FALSE' if op == 'CONJUNCTION' else 'TRUE'
+    dual = CONNECTIVE_DUALS[op]
+    seen = set()
+    kept = []
+    for operand in operands:
+        for part in chain_operands(operand, op):
+            if part.op == absorbing:
+                return part
+            if part.op in TRUTH_CONSTANTS or part in seen:
+                continue
+            seen.add(part)
+            kept.append(part)
+    for part in kept:
+        if part.op == 'NEGATION' and part.a in seen:
+            return truth_constant(absorbing == 'TRUE')
+    kept = [part for part in kept
+            if part.op != dual or not any(inner in seen for inner in chain_operands(part, dual))]
+    if not kept:
+        return truth_constant(absorbing == 'FALSE')
+    return build_chain(op, kept)
+
+# fold TRUE/FALSE, repeated and subsumed operands and vacuous quantifiers
+# (QxA with no free x in A is A, the domain is never empty); whole /\ and
+# \/ chains are simplified at once
+def simplify(formula):
+    done = {}
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in done:
+            stack.pop()
+            continue
+        op = node.op
+        if op in CONNECTIVE_DUALS:
+            children = chain_operands(node, op)
+        elif op == 'NEGATION':
+            children = (node.a,)
+        elif op in QUANTIFIER_DUALS:
+            children = (node.b,)
+        elif op == 'IMPLICATION':
+            children = (node.a, node.b)
+        else:
+            stack.pop()
+            done[node] = node
+            continue
+        missing = [child for child in children if child not in done]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        if op in CONNECTIVE_DUALS:
+            done[node] = simplify_chain(op, [done[child] for child in children])
+        elif op == 'NEGATION':
+            sub = done[node.a]
+            if sub.op in TRUTH_CONSTANTS:
+                done[node] = truth_constant(sub.op == 'FALSE')
+            elif sub.op == 'NEGATION':
+                done[node] = sub.a
+            else:
+                done[node] = make_formula('NEGATION', sub)
+        elif op in QUANTIFIER_DUALS:
+            body = done[node.b]
+            done[node] = body if node.a not in body.free else make_formula(op, node.a, body)
+        else:
+            a = done[node.a]
+            b = done[node.b]
+            if a.op == 'FALSE' or b.op == 'TRUE':
+                done[node] = truth_constant(True)
+            elif a.op == 'TRUE':
+                done[node] = b
+            elif b.op == 'FALSE':
+                done[node] = simplify(make_formula('NEGATION', a))
+            else:
+                done[node] = make_formula(op, a, b)
+    return done[formula]
+
+# QxA for a miniscoped A with its quantifier pushed as far in as it goes:
+# Ax distributes over /\, and operands of a /\ (for Ex) or \/ (for Ax)
+# without a free x move out of the scope, so Ax(P(x,x)/\(Q(x,x)\/p)) becomes
+# (AxP(x,x)/\(AxQ(x,x)\/p)) with a smaller body for the gamma rule. Ex is not
+# distributed over \/: that would turn one delta step into a split whose
+# sides each need a constant, before the delta rule could run
+def miniscope_quantifier(op, var, body):
+    split = 'CONJUNCTION' if op == 'FORALL' else None
+    other = 'DISJUNCTION' if op == 'FORALL' else 'CONJUNCTION'
+    results = []
+    # tasks are ('quantify', body), ('value', node) or ('build', connective, count)
+    tasks = [('quantify', body)]
+    while tasks:
+        task = tasks.pop()
+        kind = task[0]
+        if kind == 'build':
+            operands = results[-task[2]:]
+            del results[-task[2]:]
+            results.append(build_chain(task[1], operands))
+            continue
+        node = task[1]
+        if kind == 'value' or var not in node.free:
+            results.append(node)
+        elif node.op == split:
+            operands = chain_operands(node, split)
+            tasks.append(('build', split, len(operands)))
+            tasks += [('quantify', operand) for operand in reversed(operands)]
+        elif node.op == other:
+            operands = chain_operands(node, other)
+            inside = [operand for operand in operands if var in operand.free]
+            outside = [operand for operand in operands if var not in operand.free]
+            if outside:
+                tasks.append(('build', other, len(outside) + 1))
+                tasks += [('value', operand) for operand in reversed(outside)]
+                tasks.append(('quantify', build_chain(other, inside)))
+            else:
+                results.append(make_formula(op, var, node))
+        else:
+            results.append(make_formula(op, var, node))
+    return results[0]
+
+# push every quantifier of a formula in negation normal form inwards
+def miniscope(formula):
+    done = {}
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in done:
+            stack.pop()
+            continue
+        op = node.op
+        if op in CONNECTIVE_SYMBOLS:
+            children = (node.a, node.b)
+        elif op in QUANTIFIER_DUALS:
+            children = (node.b,)
+        else:
+            stack.pop()
+            done[node] = node
+            continue
+        missing = [child for child in children if child not in done]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        if op in QUANTIFIER_DUALS:
+            done[node] = miniscope_quantifier(op, node.a, done[node.b])
+        else:
+            done[node] = make_formula(op, done[node.a], done[node.b])
+    return done[formula]
+
+# the passes preprocess runs, in order
+PREPROCESS_PASSES = (('nnf', negation_normal_form), ('simplify', simplify),
+                     ('miniscope', miniscope), ('simplify', simplify))
+
+# an equisatisfiable formula for the tableau, computed once per formula
+# instead of on every branch; report, if given, gets a (pass, size before,
+# size after) entry for every pass
+def preprocess(formula, report=None):
+    for name, run in PREPROCESS_PASSES:
+        result = run(formula)
+        if report is not None:
+            report.append((name, formula_size(formula), formula_size(result)))
+        formula = result
+    return formula
+
+###### witnesses
+
+# a satisfying interpretation of source: the constants in domain name its
+# elements (and themselves), atoms lists the true propositional letters and
+# bare variables and extensions maps each predicate letter to the sorted
+# argument tuples it holds for; everything else is false
+class Model:
+    __slots__ = ('source', 'domain', 'atoms', 'extensions')
+    kind = 'model'
+
+    def __init__(self, source, domain, atoms, extensions):
+        self.source = source
+        self.domain = domain
+        self.atoms = atoms
+        self.extensions = extensions
+
+# why source is unsatisfiable. kind is one of
+# - 'tableau': steps close every branch of a tableau for formula, which is
+#   preprocess(source) (or source itself); each step is (rule, premise,
+#   constant) in the order a depth first walk of the tableau meets them:
+#   'n' normalises ~~, ~A and ~E in front of the premise, 'a' and 'b' are
+#   the alpha and beta rules (the left side of a 'b' comes first), 'd' and
+#   'g' the delta and gamma rules with constant, and 'x' closes the branch on
+#   the premise atom and its negation (or on FALSE)
+# - 'rup': steps are clauses over tseitin(formula), each following from the
+#   ones before by unit propagation, the last one empty
+# - 'truth-table': formula is false under all 16 valuations
+class Proof:
+    __slots__ = ('kind', 'source', 'formula', 'steps')
+
+    def __init__(self, kind, source, formula, steps):
+        self.kind = kind
+        self.source = source
+        self.formula = formula
+        self.steps = steps
+
+# the model an open, fully expanded branch describes: its positive literals
+# are true, everything else false, and its constants make up the domain
+def branch_model(branch, source):
+    atoms = []
+    extensions = {}
+    segment = branch
+    while segment is not None:
+        for atom_id in segment.positive:
+            node = formula_by_id(atom_id)
+            if node.op == 'PRED':
+                extensions.setdefault(node.a, set()).add(tuple(arg.a for arg in node.b))
+            else:
+                atoms.append(node.a)
+        segment = segment.parent
+    domain = sorted(set(iter_stack(branch.constants))) or [constant_name(0)]
+    return Model(source, domain, sorted(atoms), {name: sorted(args) for name, args in extensions.items()})
+
+# the steps recorded on the traces of a closed tableau, in the order of a
+# depth first walk, as a Proof
+def tableau_proof(root, formula):
+    steps = []
+    stack = [root]
+    while stack:
+        branch = stack.pop()
+        for rule, node, extra in branch.trace:
+            if rule == 'b':
+                steps.append(('b', node, None))
+                # a split always ends its segment; left side first
+                stack += reversed(extra)
+            else:
+                steps.append((rule, node, extra))
+        if branch.clash is not None:
+            steps.append(('x', branch.clash, None))
+    return Proof('tableau', formula, formula, steps)
+
+# does the model satisfy its formula, evaluated over the finite domain
+def check_model(model):
+    atoms = set(model.atoms)
+    extensions = {name: set(tuple(args) for args in tuples) for name, tuples in model.extensions.items()}
+    domain = [make_formula('FOL_VAR', name) for name in model.domain]
+    values = {}
+    stack = [model.source]
+    while stack:
+        node = stack[-1]
+        if node in values:
+            stack.pop()
+            continue
+        op = node.op
+        if op in QUANTIFIER_DUALS:
+            children = [substitute(node.b, node.a, element) for element in domain]
+        elif op == 'NEGATION':
+            children = [node.a]
+        elif op in CONNECTIVE_SYMBOLS:
+            children = [node.a, node.b]
+        else:
+            stack.pop()
+            if op == 'PRED':
+                values[node] = tuple(arg.a for arg in node.b) in extensions.get(node.a, ())
+            elif op in TRUTH_CONSTANTS:
+                values[node] = op == 'TRUE'
+            else:
+                values[node] = node.a in atoms
+            continue
+        missing = [child for child in children if child not in values]
+        if missing:
+            stack += missing
+            continue
+        stack.pop()
+        if op == 'FORALL':
+            values[node] = all(values[child] for child in children)
+        elif op == 'EXISTS':
+            values[node] = any(values[child] for child in children)
+        elif op == 'NEGATION':
+            values[node] = not values[node.a]
+        elif op == 'CONJUNCTION':
+            values[node] = values[node.a] and values[node.b]
+        elif op == 'DISJUNCTION':
+            values[node] = values[node.a] or values[node.b]
+        else:
+            values[node] = not values[node.a] or values[node.b]
+    return values[model.source]
+
+# does unit propagation from the negation of clause run into a conflict
+# with clauses
+def propagation_implies(clauses, clause):
+    value = {}
+    for literal in clause:
+        if value.get(-literal):
+            # a tautology
+            return True
+        value[-literal] = True
+    changed = True
+    while changed:
+        changed = False
+        for other in clauses:
+            unassigned = None
+            count = 0
+            for literal in other:
+                if value.get(literal):
+                    break
+                # tseitin can repeat a literal within a clause
+                if not value.get(-literal) and literal != unassigned:
+                    unassigned = literal
+                    count += 1
+            else:
+                if count == 0:
+                    return True
+                if count == 1:
+                    value[unassigned] = True
+                    changed = True
+    return False
+
+# replay a Proof without trusting the search that produced it
+def check_proof(proof):
+    if proof.kind == 'truth-table':
+        return truth_mask(proof.formula) == 0
+    if proof.kind == 'rup':
+        clauses, _ = tseitin(proof.formula)
+        for clause in proof.steps:
+            if not propagation_implies(clauses, clause):
+                return False
+            clauses.append(clause)
+        return bool(proof.steps) and not proof.steps[-1]
+    if proof.source is not proof.formula and preprocess(proof.source) is not proof.formula:
+        return False
+
+    # formulas on the branch being checked, and the branches still to close
+    branch = {double_negation(proof.formula)}
+    pending = []
+    for rule, premise, constant in proof.steps:
+        if branch is None or premise not in branch:
+            return False
+        if rule == 'x':
+            if premise.op != 'FALSE' and make_formula('NEGATION', premise) not in branch:
+                return False
+            branch = pending.pop() if pending else None
+        elif rule == 'n':
+            branch.add(double_negation(double_negation(clean_fol_formula(premise))))
+        elif rule == 'a':
+            expanded = alpha_expansion(premise)
+            if expanded is premise:
+                return False
+            for formula in expanded:
+                branch.add(double_negation(formula))
+        elif rule == 'b':
+            if not is_beta(premise):
+                return False
+            left, right = beta_expansion(premise)
+            other = set(branch)
+            other.add(double_negation(right))
+            pending.append(other)
+            branch.add(double_negation(left))
+        elif rule == 'd':
+            if premise.op != 'EXISTS' or any(constant in formula.free for formula in branch):
+                return False
+            branch.add(double_negation(delta_expansion(premise, constant)))
+        elif rule == 'g':
+            if premise.op != 'FORALL':
+                return False
+            branch.add(double_negation(gamma_expansion(premise, [constant])[0]))
+        else:
+            return False
+    return branch is None
+
+def check_witness(witness):
+    if witness.kind == 'model':
+        return check_model(witness)
+    return check_proof(witness)
+
+# the witness of a SatResult as lines of text, produced one at a time so a
+# long proof can go straight to a file:
+#   s <code> <kind>        starts a witness; kind is model, a Proof kind or,
+#                          when there is no witness, the reason or none
+#   f <n> <formula>        formula n, written before its first use
+#   r <n>                  the formula whose satisfiability was asked
+#   m <constants>          the domain of a model
+#   t <atoms>              the true atoms of a model
+#   e <letter> <args>      one tuple of a predicate's extension
+#   o <n>                  the formula a proof is about
+#   <rule> <n> [constant]  one tableau step
+#   l <literals>           one clause of a rup proof
+def witness_lines(result):
+    witness = result.witness
+    if witness is None:
+        yield 's %d %s' % (result, result.reason or 'none')
+        return
+    numbers = {}
+    yield 's %d %s' % (result, witness.kind)
+    formula = witness.source if witness.kind == 'model' else witness.formula
+    for node in (witness.source, formula):
+        if node not in numbers:
+            numbers[node] = len(numbers)
+            yield 'f %d %s' % (numbers[node], formula_to_string(node))
+    yield 'r %d' % numbers[witness.source]
+    if witness.kind == 'model':
+        yield ' '.join(['m'] + witness.domain)
+        yield ' '.join(['t'] + witness.atoms)
+        for name in sorted(witness.extensions):
+            for args in witness.extensions[name]:
+                yield ' '.join(['e', name] + list(args))
+        return
+    yield 'o %d' % numbers[formula]
+    for step in witness.steps:
+        if witness.kind == 'rup':
+            yield ' '.join(['l'] + [str(literal) for literal in step])
+            continue
+        rule, node, constant = step
+        if node not in numbers:
+            numbers[node] = len(numbers)
+            yield 'f %d %s' % (numbers[node], formula_to_string(node))
+        if constant is None:
+            yield '%s %d' % (rule, numbers[node])
+        else:
+            yield '%s %d %s' % (rule, numbers[node], constant)
+
+def write_witness(result, out):
+    for line in witness_lines(result):
+        out.write(line + '\n')
+
+# the SatResults (codes and witnesses only) written by write_witness to a
+# stream or list of lines, one at a time
+def read_witnesses(lines):
+    block = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line[:2] == 's ':
+            if block is not None:
+                yield witness_from_lines(block)
+            block = []
+        if block is not None and line:
+            block.append(line)
+    if block is not None:
+        yield witness_from_lines(block)
+
+def witness_from_lines(block):
+    _, code, kind = block[0].split(' ', 2)
+    formulas = {}
+    source = None
+    formula = None
+    domain = []
+    atoms = []
+    extensions = {}
+    steps = []
+    for line in block[1:]:
+        fields = line.split(' ')
+        tag = fields[0]
+        if tag == 'f':
+            text = line.split(' ', 2)[2]
+            if text in ('true', 'false'):
+                formulas[fields[1]] = truth_constant(text == 'true')
+            else:
+                formulas[fields[1]] = parse_formula(lexer(text))
+        elif tag == 'r':
+            source = formulas[fields[1]]
+        elif tag == 'o':
+            formula = formulas[fields[1]]
+        elif tag == 'm':
+            domain = fields[1:]
+        elif tag == 't':
+            atoms = fields[1:]
+        elif tag == 'e':
+            extensions.setdefault(fields[1], []).append(tuple(fields[2:]))
+        elif tag == 'l':
+            steps.append([int(literal) for literal in fields[1:]])
+        else:
+            steps.append((tag, formulas[fields[1]], fields[2] if len(fields) > 2 else None))
+    if kind == 'model':
+        witness = Model(source, domain, atoms, extensions)
+    elif source is not None:
+        witness = Proof(kind, source, formula, steps)
+    else:
+        return SatResult(int(code), kind)
+    return SatResult(int(code), None, None, witness)
+
+# You may choose to represent a theory as a set or a list
+def theory(fmla):
+    return TableauNode(analyse(fmla).formula)
+    
+# the engines sat can search first-order formulas with: the ground tableau
+# of is_satisfiable, the free-variable tableau, or the ground one followed
+# by the free-variable one when it runs out of constants
+ENGINES = ('ground', 'free', 'models', 'auto')
+
+# check for satisfiability
+def sat(tableau, schedule='dfs', budget=None, witness=False, probe=None, workers=1, engine='ground'):
+    # output 0 if not satisfiable, output 1 if satisfiable, output 2 if the number of constants exceeds MAX_CONSTANTS
+    # or the optional Budget runs out (the SatResult returned says which)
+    # schedule picks the order open branches are expanded in, see SCHEDULERS;
+    # propositional formulas skip the tableau: over p, q, r, s they are
+    # answered from their truth table, otherwise by the CDCL solver, which
+    # also refutes them when a witness is asked for, to give a RUP proof.
+    # with witness, a 0 or 1 result carries a Proof or Model in .witness, and
+    # a Probe sees the tableau search (the fast paths do not build one).
+    # with workers other than 1 the tableau is searched on that many
+    # processes (None for one per CPU), without witness or probe support.
+    # engine picks one of ENGINES: the tableau, the free-variable tableau,
+    # which has no witness or probe support, the finite model search, which
+    # can only answer 1, or auto, which runs the tableau and, if it runs out
+    # of constants, looks for a model and then (without witness or probe)
+    # tries the free-variable tableau, each with what is left of the budget.
+    # the tableau can also be given as the text of a formula
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}, expected one of {list(ENGINES)}")
+    if engine == 'free' and (witness or probe is not None):
+        raise ValueError('the free-variable engine gives no witnesses and takes no probe')
+    if engine == 'models' and probe is not None:
+        raise ValueError('the model search takes no probe')
+    if isinstance(tableau, str):
+        parsed = analyse(tableau)
+        if not parsed.code:
+            raise ValueError('%r is not a formula' % tableau)
+        tableau = [TableauNode(parsed.formula)]
+    formula = tableau[0].nodes
+    mask = truth_mask(formula)
+    if mask is not None and (mask or not witness):
+        return truth_table_sat(mask, formula if witness else None)
+    if is_propositional(formula):
+        return propositional_sat(formula, budget, witness)
+    # first-order formulas are preprocessed, which can settle them on its own
+    source = formula
+    formula = preprocess(formula)
+    if formula.op in TRUTH_CONSTANTS:
+        found = None
+        if witness and formula.op == 'TRUE':
+            found = Model(source, sorted(source.free) or [constant_name(0)], [], {})
+        elif witness:
+            found = Proof('tableau', source, formula, [('x', formula, None)])
+        return SatResult(1 if formula.op == 'TRUE' else 0, None, {'preprocessed': True}, found)
+    if engine == 'free':
+        return free_variable_sat(formula, budget)
+    if engine == 'models':
+        out = finite_model_sat(formula, budget)
+    elif workers != 1 and not witness and probe is None:
+        out = parallel_is_satisfiable(TableauNode(formula), schedule, budget, workers)
+    else:
+        out = is_satisfiable(TableauNode(formula), schedule, budget, witness, probe)
+    if engine == 'auto' and out.reason == 'constants':
+        budget = budget_left(budget, out.stats)
+        found = finite_model_sat(formula, budget)
+        if found == 1:
+            out = found
+        elif not witness and probe is None:
+            return free_variable_sat(formula, budget_left(budget, found.stats))
+    if not witness:
+        out.witness = None
+    elif out.witness is not None:
+        out.witness.source = source
+    return out
+
+###### incremental theories
+
+# formulas checked together, added a few at a time, with push and pop to
+# take back everything assumed since the last push. the open branches of
+# the tableau of what has been added are kept as the search left them: the
+# fully expanded one it stopped at, the ones set aside for want of
+# constants and the ones it had not got to (or, when the budget stopped
+# it, had not finished). checking a query then only expands the query and
+# the formulas added since on them, instead of starting from the root.
+# formulas are expanded at the next check or push rather than one by one
+# as they are added, so the literals of all of them are on the branches
+# before any is split, as they would be for their conjunction.
+# names free in any formula are constants on every branch from the root
+# on, so a formula bringing a new one makes the tableau start over once
+# with it (fresh constants must never take a name a formula uses)
+class Theory:
+    def __init__(self, formulas=(), schedule='dfs', budget=None):
+        if schedule not in SCHEDULERS:
+            raise ValueError(f"unknown schedule {schedule!r}, expected one of {sorted(SCHEDULERS)}")
+        self.schedule = schedule
+        # the budget of every expansion kept, a check has its own
+        self.budget = budget
+        self.names = set()
+        # one [formulas, expanded, source, branches] per push and the one
+        # below them: the formulas added at that level, how many of them
+        # the branches have expanded, the conjunction of those and the ones
+        # below (which is what is_satisfiable needs to see for the names it
+        # must not give out) and the branches still open. branches are
+        # never expanded in place, only children of them, so pop just
+        # drops the top level
+        self.levels = [[[], 0, truth_constant(True), [self.root()]]]
+        for formula in formulas:
+            self.add(formula)
+
+    def root(self):
+        root = Branch()
+        for name in sorted(self.names):
+            root.add_constant(name)
+        return root
+
+    # formula, given as a parsed formula or its text, ready for the tableau
+    def prepare(self, formula):
+        if isinstance(formula, str):
+            parsed = analyse(formula)
+            if not parsed.code:
+                raise ValueError('%r is not a formula' % formula)
+            formula = parsed.formula
+        formula = preprocess(formula)
+        if not formula.free <= self.names:
+            self.names |= formula.free
+            self.rebuild()
+        return formula
+
+    # the children of branches with formulas added, searched until one is
+    # open and fully expanded (the last of branches is expanded first);
+    # with keep the result comes with the branches still open afterwards,
+    # in the same order
+    def expand(self, branches, formulas, source, budget, keep):
+        children = []
+        for branch in branches:
+            child = Branch(branch)
+            for formula in formulas:
+                if formula.op == 'FALSE':
+                    child.closed = True
+                elif formula.op != 'TRUE':
+                    child.add(formula)
+                if child.closed:
+                    break
+            if not child.closed:
+                children.append(child)
+        kept = [] if keep else None
+        leftover = [] if keep else None
+        # is_satisfiable gives out no name free in the formula it is shown,
+        # which has to cover names only a later formula brought in
+        for name in sorted(self.names - source.free):
+            source = make_formula('CONJUNCTION', source, make_formula('FOL_VAR', name))
+        if not children:
+            out = SatResult(0, None, {'steps': 0, 'branches': 0})
+        else:
+            out = is_satisfiable(TableauNode(source), self.schedule, budget, branches=children,
+                                 leftover=leftover, kept=kept)
+        if keep:
+            return out, leftover[::-1] + kept
+        return out
+
+    # expand the formulas of level (the top one if None) added since it was
+    # last expanded
+    def settle(self, level=None):
+        if level is None:
+            level = self.levels[-1]
+        formulas, expanded, source, branches = level
+        if expanded == len(formulas):
+            return
+        for formula in formulas[expanded:]:
+            source = make_formula('CONJUNCTION', source, formula)
+        _, branches = self.expand(branches, formulas[expanded:], source, self.budget, True)
+        level[1:] = [len(formulas), source, branches]
+
+    # expand the levels below the top one again from a new root, after a
+    # new name came in; the top one is expanded at the next check or push
+    def rebuild(self):
+        branches = [self.root()]
+        source = truth_constant(True)
+        for level in self.levels:
+            level[1:] = [0, source, branches]
+            if level is not self.levels[-1]:
+                self.settle(level)
+                source = level[2]
+                branches = level[3]
+
+    # add formula to the theory, until the pop that takes back its level
+    def add(self, formula):
+        formula = self.prepare(formula)
+        self.levels[-1][0].append(formula)
+
+    def push(self):
+        self.settle()
+        _, _, source, branches = self.levels[-1]
+        self.levels.append([[], 0, source, branches])
+
+    def pop(self):
+        if len(self.levels) == 1:
+            raise IndexError('pop without a push')
+        self.levels.pop()
+
+    # the formulas added and not popped, in the order they were added
+    def formulas(self):
+        return [formula for level in self.levels for formula in level[0]]
+
+    # satisfiability of the theory together with query, if given, which is
+    # not added to it: 0, 1 or 2 as sat answers, with budget (the theory's
+    # own if None) for the query alone
+    def check(self, query=None, budget=None):
+        if query is not None:
+            query = self.prepare(query)
+        self.settle()
+        _, _, source, branches = self.levels[-1]
+        if query is None:
+            return self.expand(branches, [], source, budget, False)
+        return self.expand(branches, [query], make_formula('CONJUNCTION', source, query), budget, False)
+
+###### result cache
+
+# a formula with the same satisfiability, normalised so formulas that only
+# differ in names of bound variables, double negations, where a negation
+# sits in front of a quantifier or the order of the sides of /\ and \/
+# come out as the same node: ~~A becomes A, ~AxA becomes Ex~A, ~ExA becomes
+# Ax~A, the variable bound at nesting depth d is renamed vd and the sides
+# of a conjunction or disjunction are put in the order of their text (which
+# unlike ids is the same in every process). built with an explicit stack
+# like parse_tokens
+def canonical_form(formula):
+    results = []
+    texts = {}
+
+    def text(node):
+        found = texts.get(node)
+        if found is None:
+            found = texts[node] = formula_to_string(node)
+        return found
+
+    # visits are (node, renaming, depth), builds are (op, extra, children)
+    stack = [(formula, {}, 0)]
+    while stack:
+        item = stack.pop()
+        node = item[0]
+        if not isinstance(node, Formula):
+            op, extra, count = item
+            children = results[len(results) - count:]
+            del results[len(results) - count:]
+            if op == 'NEGATION':
+                results.append(make_formula(op, children[0]))
+            elif op == 'PRED':
+                results.append(make_formula(op, extra, tuple(children)))
+            elif op in QUANTIFIER_DUALS:
+                results.append(make_formula(op, extra, children[0]))
+            elif op != 'IMPLICATION' and text(children[1]) < text(children[0]):
+                results.append(make_formula(op, children[1], children[0]))
+            else:
+                results.append(make_formula(op, children[0], children[1]))
+            continue
+
+        renaming = item[1]
+        depth = item[2]
+        while node.op == 'NEGATION' and node.a.op in ('NEGATION', 'FORALL', 'EXISTS'):
+            if node.a.op == 'NEGATION':
+                node = node.a.a
+            else:
+                node = make_formula(QUANTIFIER_DUALS[node.a.op], node.a.a, make_formula('NEGATION', node.a.b))
+        op = node.op
+        if op == 'PROP_VAR':
+            results.append(node)
+        elif op == 'FOL_VAR':
+            results.append(make_formula(op, renaming.get(node.a, node.a)))
+        elif op == 'NEGATION':
+            stack.append((op, None, 1))
+            stack.append((node.a, renaming, depth))
+        elif op in QUANTIFIER_DUALS:
+            name = 'v' + str(depth)
+            inner = dict(renaming)
+            inner[node.a] = name
+            stack.append((op, name, 1))
+            stack.append((node.b, inner, depth + 1))
+        elif op == 'PRED':
+            stack.append((op, node.a, len(node.b)))
+            for arg in reversed(node.b):
+                stack.append((arg, renaming, depth))
+        else:
+            stack.append((op, None, 2))
+            stack.append((node.b, renaming, depth))
+            stack.append((node.a, renaming, depth))
+    return results[0]
+
+# satisfiability answers keyed by the text of canonical_form, so they
+# survive clear_formula_table and can be shared through a file. the
+# in-memory layer keeps at most capacity answers and evicts the least
+# recently used one (dicts keep insertion order, so a hit moves its key to
+# the end); with a path the answers are also kept in an SQLite file that
+# any number of runs and processes can share, holding at most
+# disk_capacity rows and dropping the oldest ones first
+class SatCache:
+    def __init__(self, capacity=100000, path=None, disk_capacity=None):
+        self.capacity = capacity
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_capacity = disk_capacity
+        self.db = None
+        self.unsaved = []
+        if path is not None:
+            import sqlite3
+            self.db = sqlite3.connect(path, timeout=60)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS sat (key TEXT PRIMARY KEY, code INTEGER)')
+            self.db.commit()
+
+    def get(self, key):
+        code = self.entries.pop(key, None)
+        if code is None and self.db is not None:
+            row = self.db.execute('SELECT code FROM sat WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                code = row[0]
+        if code is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.remember(key, code)
+        return code
+
+    def put(self, key, code):
+        self.entries.pop(key, None)
+        self.remember(key, code)
+        if self.db is not None:
+            self.unsaved.append((key, code))
+            if len(self.unsaved) >= 1000:
+                self.flush()
+
+    def remember(self, key, code):
+        self.entries[key] = code
+        if len(self.entries) > self.capacity:
+            del self.entries[next(iter(self.entries))]
+            self.evictions += 1
+
+    # write pending answers to the SQLite file
+    def flush(self):
+        if self.db is None or not self.unsaved:
+            return
+        self.db.executemany('INSERT OR REPLACE INTO sat (key, code) VALUES (?, ?)', self.unsaved)
+        self.unsaved = []
+        if self.disk_capacity is not None:
+            self.db.execute('DELETE FROM sat WHERE rowid IN (SELECT rowid FROM sat ORDER BY rowid '
+                            'LIMIT max(0, (SELECT count(*) FROM sat) - ?))', (self.disk_capacity,))
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(),
+                'evictions': self.evictions, 'size': len(self.entries)}
+
+# satisfiability through a SatCache; undetermined answers depend on the
+# schedule, the budget and MAX_CONSTANTS, so only definite ones are stored
+def cached_sat(tableau, cache, schedule='dfs', budget=None, engine='ground'):
+    key = formula_to_string(canonical_form(tableau[0].nodes))
+    code = cache.get(key)
+    if code is not None:
+        return SatResult(code, None, {'cached': True})
+    out = sat(tableau, schedule, budget, engine=engine)
+    if out != 2:
+        cache.put(key, int(out))
+    return out
+
+###### batch mode
+
+# same texts as parseOutputs and satOutput in the driver below
+PARSE_OUTPUTS = ['not a formula',
+                 'an atom',
+                 'a negation of a first order logic formula',
+                 'a universally quantified formula',
+                 'an existentially quantified formula',
+                 'a binary connective first order formula',
+                 'a proposition',
+                 'a negation of a propositional formula',
+                 'a binary connective propositional formula']
+
+SAT_OUTPUTS = ['is not satisfiable', 'is satisfiable', 'may or may not be satisfiable']
+
+# a worker's interned formulas are dropped once there are this many of them
+INTERN_LIMIT = 1000000
+
+# clear the formula table once it has grown past INTERN_LIMIT, if it is this
+# process's own (see own_formula_table)
+def trim_formula_table():
+    if _OWN_FORMULAS and len(_FORMULAS) > INTERN_LIMIT:
+        clear_formula_table()
+
+# the lines the driver prints for one input line, without the final newline
+def check_line(line, do_parse, do_sat, budget=None, cache=None, parsed=None, mask=None, witness=False):
+    # a caller checking many lines can pass each one's analysis and, for
+    # propositional formulas, its truth mask computed in one batch. with
+    # witness the result is (output, witness text in the witness_lines
+    # format, empty if the line got no SAT answer); the cache only knows
+    # answers, so it is not used then
+    if parsed is None:
+        parsed = analyse(line)
+    output = []
+    if do_parse:
+        text = "%s is %s." % (line, PARSE_OUTPUTS[parsed.code])
+        if parsed.code in [5, 8]:
+            text += " Its left hand side is %s, its connective is %s, and its right hand side is %s." % (parsed.lhs, parsed.con, parsed.rhs)
+        output.append(text)
+    found = ''
+    if do_sat:
+        if parsed.code:
+            if witness:
+                if mask:
+                    out = truth_table_sat(mask, parsed.formula)
+                else:
+                    out = sat([TableauNode(parsed.formula)], budget=budget, witness=True)
+                found = ''.join(text + '\n' for text in witness_lines(out))
+            elif mask is not None:
+                out = truth_table_sat(mask)
+            elif cache is None:
+                out = sat([TableauNode(parsed.formula)], budget=budget)
+            else:
+                out = cached_sat([TableauNode(parsed.formula)], cache, budget=budget)
+            output.append('%s %s.' % (line, SAT_OUTPUTS[out]))
+        else:
+            output.append('%s is not a formula.' % line)
+    if witness:
+        return '\n'.join(output), found
+    return '\n'.join(output)
+
+# one SatCache per process for every (capacity, path) cache spec, opened on
+# first use so forked workers never share an SQLite connection
+_BATCH_CACHES = {}
+
+def batch_cache(spec):
+    if spec is None:
+        return None
+    cache = _BATCH_CACHES.get(spec)
+    if cache is None:
+        cache = SatCache(spec[0], spec[1])
+        _BATCH_CACHES[spec] = cache
+    return cache
+
+# check a chunk of lines, run inside the worker processes; returns the
+# outputs and how many cache hits and misses the chunk had. parsed holds
+# the lines' analyses when they are already known
+def check_lines(lines, do_parse, do_sat, budget=None, cache_spec=None, witness=False, parsed=None):
+    cache = batch_cache(cache_spec)
+    if cache is not None:
+        hits = cache.hits
+        misses = cache.misses
+    if parsed is None:
+        parsed = [analyse(line) for line in lines]
+    if do_sat:
+        # every propositional formula in the chunk in one vectorised call
+        masks = truth_masks([p.formula if p.code else None for p in parsed])
+    else:
+        masks = [None] * len(lines)
+    results = [check_line(line, do_parse, do_sat, budget, cache, p, mask, witness)
+               for line, p, mask in zip(lines, parsed, masks)]
+    # independent formulas share nothing, so a long running worker can
+    # start over with an empty table instead of growing without bound
+    trim_formula_table()
+    if cache is None:
+        return results, 0, 0
+    # let other processes see this chunk's answers
+    cache.flush()
+    return results, cache.hits - hits, cache.misses - misses
+
+# check_lines for a chunk of a compiled input, (names, records) as
+# compiled_chunks gives it, decoding the formulas instead of parsing
+def check_compiled(chunk, do_parse, do_sat, budget=None, cache_spec=None, witness=False):
+    names, records = chunk
+    lines = []
+    formulas = []
+    text = None
+    for kind, item in iter_records(records, 0, list(names)):
+        if kind == 'T':
+            text = item
+        else:
+            # a formula record without text is a line formula_to_string gives back
+            lines.append(formula_to_string(item) if text is None else text)
+            formulas.append(item)
+            text = None
+    parsed = [ParsedFormula(line, formula) for line, formula in zip(lines, formulas)]
+    return check_lines(lines, do_parse, do_sat, budget, cache_spec, witness, parsed)
+
+# write an input in the input.txt format to out (a binary stream) compiled:
+# its header line and then every line with its parsed formula, as formula
+# records of the binary format, each after a text record only if the line
+# is not the formula as formula_to_string writes it
+def compile_input(stream, out):
+    writer = FormulaWriter(out)
+    writer.write_text(stream.readline().rstrip('\n'))
+    count = 0
+    for line in read_lines(stream):
+        formula = analyse(line).formula
+        if formula is None or formula_to_string(formula) != line:
+            writer.write_text(line)
+        writer.write_formula(formula)
+        count += 1
+    return count
+
+# the header line of a compiled input in buffer, and its lines in chunks of
+# at most size as (names, records): the atom table before the chunk and
+# the bytes of its records. only record headers are read here, the
+# formulas are decoded where the chunk is checked
+def compiled_chunks(buffer, size):
+    if bytes(buffer[:len(FORMAT_MAGIC)]) != FORMAT_MAGIC:
+        raise ValueError('not a compiled input')
+    i = len(FORMAT_MAGIC)
+    if i >= len(buffer) or buffer[i] != ord('T'):
+        raise ValueError('compiled input without a header line')
+    length, i = read_varint(buffer, i + 1)
+    header = bytes(buffer[i:i + length]).decode('utf-8')
+    i += length
+
+    def chunks(i):
+        names = []
+        end = len(buffer)
+        start = i
+        chunk_names = ()
+        count = 0
+        while i < end:
+            kind = buffer[i]
+            length, j = read_varint(buffer, i + 1)
+            if kind == ord('A'):
+                names.append(bytes(buffer[j:j + length]).decode('utf-8'))
+            i = j + length
+            if kind == ord('F'):
+                count += 1
+                if count == size:
+                    yield chunk_names, bytes(buffer[start:i])
+                    chunk_names = tuple(names)
+                    start = i
+                    count = 0
+        if count:
+            yield chunk_names, bytes(buffer[start:i])
+
+    return header, chunks(i)
+
+# the lines of an input stream without their newlines
+def read_lines(stream):
+    for line in stream:
+        if line[-1:] == '\n':
+            line = line[:-1]
+        yield line
+
+# consecutive lists of at most size lines
+def chunked(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# stream an input in the input.txt format (a PARSE/SAT header line, then one
+# formula per line) to out, writing results in input order; instead of a
+# text stream it can be a buffer (bytes, memoryview or mmap) holding the
+# input as compile_input writes it, which skips parsing. with more than
+# one worker, chunks of lines are checked in a process pool and at most
+# max_pending chunks are in flight, which bounds the reorder buffer. an
+# optional Budget caps every single SAT check so no line can stall a worker,
+# and cache_spec = (capacity, path or None) answers repeated formulas from a
+# SatCache in every process. with witness_out, the witness of every SAT
+# answer is streamed there in input order (see witness_lines). returns the
+# number of lines and cache hits/misses
+def batch(stream, out, workers=None, chunk_size=64, max_pending=None, budget=None, cache_spec=None,
+          witness_out=None):
+    if hasattr(stream, 'encoding'):
+        firstline = stream.readline()
+        chunks = chunked(read_lines(stream), chunk_size)
+        check = check_lines
+    else:
+        firstline, chunks = compiled_chunks(stream, chunk_size)
+        check = check_compiled
+    do_parse = 'PARSE' in firstline
+    do_sat = 'SAT' in firstline
+    witness = witness_out is not None
+    totals = {'lines': 0, 'cache_hits': 0, 'cache_misses': 0}
+
+    def write(checked):
+        results, hits, misses = checked
+        totals['lines'] += len(results)
+        totals['cache_hits'] += hits
+        totals['cache_misses'] += misses
+        for result in results:
+            if witness:
+                result, found = result
+                witness_out.write(found)
+            if result:
+                out.write(result + '\n')
+
+    if workers == 1:
+        for chunk in chunks:
+            write(check(chunk, do_parse, do_sat, budget, cache_spec, witness))
+        return totals
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    # forked workers inherit the module as it is, interned formulas and
+    # all, a spawned one would start from an empty formula table
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=own_formula_table) as executor:
+        pending = []
+        for chunk in chunks:
+            pending.append(executor.submit(check, chunk, do_parse, do_sat, budget, cache_spec, witness))
+            if len(pending) >= max_pending:
+                write(pending.pop(0).result())
+        for future in pending:
+            write(future.result())
+    return totals
+
+# python3 tableau.py --batch [FILE] [--workers N] [--chunk-size N]
+#                            [--max-steps N] [--max-branches N] [--max-memory MB] [--max-seconds S]
+#                            [--max-constants N]
+#                            [--cache-size N] [--cache-file PATH] [--witness-file PATH]
+# reads FILE (stdin if missing or -) instead of input.txt, or the same
+# input compiled by --compile, which is mapped into memory instead of
+# parsed; with a cache the hit rate is reported on stderr, and witnesses go
+# to the witness file
+def batch_main(argv):
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(prog='tableau.py --batch')
+    parser.add_argument('file', nargs='?', default='-')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--max-pending', type=int, default=None)
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--max-branches', type=int, default=None)
+    parser.add_argument('--max-memory', type=float, default=None, help='megabytes')
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('--max-constants', type=int, default=None)
+    parser.add_argument('--cache-size', type=int, default=None)
+    parser.add_argument('--cache-file', default=None)
+    parser.add_argument('--witness-file', default=None)
+    args = parser.parse_args(argv)
+    max_memory = None if args.max_memory is None else int(args.max_memory * 1024 * 1024)
+    budget = Budget(args.max_steps, args.max_branches, max_memory, args.max_seconds, args.max_constants)
+    cache_spec = None
+    if args.cache_size is not None or args.cache_file is not None:
+        cache_spec = (args.cache_size or 100000, args.cache_file)
+    stream = sys.stdin if args.file == '-' else open(args.file)
+    mapped = None
+    if stream is not sys.stdin and stream.buffer.peek(len(FORMAT_MAGIC))[:len(FORMAT_MAGIC)] == FORMAT_MAGIC:
+        import mmap
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    witness_out = None if args.witness_file is None else open(args.witness_file, 'w')
+    try:
+        totals = batch(stream if mapped is None else mapped, sys.stdout, args.workers, args.chunk_size,
+                       args.max_pending, budget, cache_spec, witness_out)
+        if cache_spec is not None:
+            lookups = totals['cache_hits'] + totals['cache_misses']
+            rate = totals['cache_hits'] / lookups if lookups else 0.0
+            sys.stderr.write('cache: %d hits, %d misses, hit rate %.3f\n' % (totals['cache_hits'], totals['cache_misses'], rate))
+    finally:
+        if mapped is not None:
+            mapped.close()
+        if stream is not sys.stdin:
+            stream.close()
+        if witness_out is not None:
+            witness_out.close()
+
+# python3 tableau.py --compile [FILE] OUTPUT
+# parses FILE (stdin if missing or -) in the input.txt format once and
+# writes it to OUTPUT compiled, for --batch to read without parsing
+def compile_main(argv):
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(prog='tableau.py --compile')
+    parser.add_argument('file', nargs='?', default='-')
+    parser.add_argument('output')
+    args = parser.parse_args(argv)
+    stream = sys.stdin if args.file == '-' else open(args.file)
+    try:
+        with open(args.output, 'wb') as out:
+            compile_input(stream, out)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+###### benchmarks
+
+# the example corpora next to this file, each an input.txt and the
+# output.txt the driver should print for it
+BENCHMARK_CORPORA = ['testinput%d' % i for i in range(1, 7)]
+
+# right nested chain of one binary connective over formula texts
+def chain_text(connective, texts):
+    text = texts[-1]
+    for other in reversed(texts[:-1]):
+        text = '(%s%s%s)' % (other, connective, text)
+    return text
+
+# n + 1 pigeons in n holes with ground atoms P(pigeon,hole): every pigeon
+# sits in a hole and no hole holds two. the propositional letters stop at
+# s, so pigeons are the constants c1.. and holes d1..; the tableau needs
+# exponentially many branches to close it
+def pigeonhole(n):
+    pigeons = ['c%d' % i for i in range(1, n + 2)]
+    holes = ['d%d' % j for j in range(1, n + 1)]
+    conjuncts = [chain_text('\\/', ['P(%s,%s)' % (pigeon, hole) for hole in holes]) for pigeon in pigeons]
+    for hole in holes:
+        for i, pigeon in enumerate(pigeons):
+            for other in pigeons[i + 1:]:
+                conjuncts.append('~(P(%s,%s)/\\P(%s,%s))' % (pigeon, hole, other, hole))
+    return chain_text('/\\', conjuncts)
+
+# n + 1 nested existentials linked by P and ending in Q(v,v) at the last
+# witness, next to a universal ruling out Q there. every level needs one
+# more constant and a round of gamma instances over all of them, so n stops
+# at MAX_CONSTANTS - 1
+def quantifier_chain(n):
+    names = 'xyzw'
+    text = 'Q(%s,%s)' % (names[n % 4], names[n % 4])
+    for k in reversed(range(n)):
+        text = 'E%s(P(%s,%s)/\\%s)' % (names[(k + 1) % 4], names[k % 4], names[(k + 1) % 4], text)
+    return '(Ex%s/\\AxAy(P(x,y)=>~Q(y,y)))' % text
+
+# a disjunction of n ground atoms next to the negation of every one of them
+def wide_disjunction(n):
+    atoms = ['P(c%d,c%d)' % (i, i) for i in range(1, n + 1)]
+    return '(%s/\\%s)' % (chain_text('\\/', atoms), chain_text('/\\', ['~' + atom for atom in atoms]))
+
+# generated scaling families: a formula for every size, all unsatisfiable
+BENCHMARK_FAMILIES = {'pigeonhole': (pigeonhole, (1, 2, 3)),
+                      'quantifier-chain': (quantifier_chain, tuple(range(1, MAX_CONSTANTS))),
+                      'wide-disjunction': (wide_disjunction, (2, 4, 8, 16, 32, 64))}
+
+# the benchmark cases as (suite, name, do_parse, do_sat, line, expected
+# output lines): every line of the corpora below root (the directory of
+# this file if missing), then every size of the families
+def benchmark_cases(root=None, corpora=BENCHMARK_CORPORA, families=BENCHMARK_FAMILIES):
+    import os
+    if root is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+    for corpus in corpora:
+        with open(os.path.join(root, corpus, 'input.txt')) as stream:
+            firstline = stream.readline()
+            lines = list(read_lines(stream))
+        with open(os.path.join(root, corpus, 'output.txt')) as stream:
+            expected = list(read_lines(stream))
+        do_parse = 'PARSE' in firstline
+        do_sat = 'SAT' in firstline
+        # the driver prints one line per question asked about each formula
+        per_line = do_parse + do_sat
+        for i, line in enumerate(lines):
+            yield corpus, str(i + 1), do_parse, do_sat, line, expected[i * per_line:(i + 1) * per_line]
+    for family in sorted(families):
+        make, sizes = families[family]
+        for n in sizes:
+            line = make(n)
+            yield family, str(n), False, True, line, ['%s %s.' % (line, SAT_OUTPUTS[0])]
+
+# check one formula the way the driver does, from an empty formula table as
+# in a fresh process if the table is this process's own (otherwise from the
+# table as it is, so the caller's formulas stay valid); returns the output
+# lines and the seconds spent parsing and in sat (the best of repeat runs),
+# the answer with the branches and steps of the search, and (with memory)
+# the peak bytes allocated, taken in a separate traced run so tracing does
+# not slow down the timed ones
+def measure_case(line, do_parse, do_sat, budget=None, memory=True, repeat=1):
+    import time
+    clock = time.perf_counter
+    record = {'parse_seconds': None, 'sat_seconds': None, 'answer': None, 'reason': None,
+              'branches': None, 'steps': None, 'peak_memory': None}
+    for _ in range(repeat):
+        if _OWN_FORMULAS:
+            clear_formula_table()
+        started = clock()
+        parsed = analyse(line)
+        seconds = clock() - started
+        if record['parse_seconds'] is None or seconds < record['parse_seconds']:
+            record['parse_seconds'] = seconds
+        if do_sat and parsed.code:
+            tableau = [theory(line)]
+            started = clock()
+            out = sat(tableau, budget=budget)
+            seconds = clock() - started
+            if record['sat_seconds'] is None or seconds < record['sat_seconds']:
+                record['sat_seconds'] = seconds
+    output = []
+    if do_parse:
+        output.append(check_line(line, True, False, parsed=parsed))
+    if do_sat and parsed.code:
+        record['answer'] = int(out)
+        record['reason'] = out.reason
+        if out.stats is not None:
+            record['branches'] = out.stats.get('branches')
+            record['steps'] = out.stats.get('steps')
+        output.append('%s %s.' % (line, SAT_OUTPUTS[out]))
+    elif do_sat:
+        output.append('%s is not a formula.' % line)
+    if memory:
+        import tracemalloc
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        if _OWN_FORMULAS:
+            clear_formula_table()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            parsed = analyse(line)
+            if do_sat and parsed.code:
+                sat([theory(line)], budget=budget)
+            record['peak_memory'] = tracemalloc.get_traced_memory()[1] - before
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+    return output, record
+
+# measure every case, yielding one record per case: its suite, name and
+# formula, whether the output matched the expected lines, and the
+# measurements of measure_case
+def run_benchmarks(cases, budget=None, memory=True, repeat=1):
+    for suite, name, do_parse, do_sat, line, expected in cases:
+        output, record = measure_case(line, do_parse, do_sat, budget, memory, repeat)
+        record['suite'] = suite
+        record['name'] = name
+        record['formula'] = line
+        record['matches'] = output == expected
+        yield record
+
+# how far a measure may grow over its baseline before it is a regression:
+# a fraction of the baseline value, and a floor in the measure's own unit
+# below which the change is noise
+BENCHMARK_THRESHOLDS = {'parse_seconds': (0.5, 0.005),
+                        'sat_seconds': (0.5, 0.005),
+                        'branches': (0.1, 0),
+                        'peak_memory': (0.25, 65536)}
+
+# the ways records fall behind the baseline records of the same formulas,
+# as one message each: a changed answer, output that stopped matching, or a
+# measure grown past its threshold. a case missing from the baseline only
+# counts if its output does not match
+def benchmark_regressions(records, baseline, thresholds=BENCHMARK_THRESHOLDS):
+    previous = {}
+    for old in baseline:
+        previous[old['suite'], old['name'], old['formula']] = old
+    regressions = []
+    for record in records:
+        case = '%s %s' % (record['suite'], record['name'])
+        old = previous.get((record['suite'], record['name'], record['formula']))
+        if old is None:
+            if not record['matches']:
+                regressions.append('%s: output does not match' % case)
+            continue
+        if old['matches'] and not record['matches']:
+            regressions.append('%s: output no longer matches' % case)
+        if record['answer'] != old['answer']:
+            regressions.append('%s: answer %s, was %s' % (case, record['answer'], old['answer']))
+        for measure, (fraction, floor) in sorted(thresholds.items()):
+            new = record.get(measure)
+            was = old.get(measure)
+            if new is None or was is None:
+                continue
+            if new > max(was * (1 + fraction), was + floor):
+                regressions.append('%s: %s %s, was %s' % (case, measure, benchmark_value(measure, new),
+                                                          benchmark_value(measure, was)))
+    return regressions
+
+# a measurement as the report prints it
+def benchmark_value(measure, value):
+    if value is None:
+        return '-'
+    if measure.endswith('_seconds'):
+        return '%.2fms' % (value * 1000)
+    if measure == 'peak_memory':
+        return '%.1fKB' % (value / 1024)
+    return str(value)
+
+BENCHMARK_COLUMNS = ('parse_seconds', 'sat_seconds', 'branches', 'peak_memory')
+
+# python3 tableau.py --benchmark [--root DIR] [--corpus NAME ...] [--family NAME ...]
+#                                [--no-corpora] [--no-families] [--no-memory] [--repeat N]
+#                                [--max-steps N] [--max-seconds S]
+#                                [--baseline FILE] [--save-baseline FILE] [--threshold MEASURE=FRACTION ...]
+# prints a row per formula and then every regression against the baseline
+# (a JSON list of records saved by an earlier run); exits with 1 if there
+# are any, without a baseline any output that does not match is one
+def benchmark_main(argv):
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(prog='tableau.py --benchmark')
+    parser.add_argument('--root', default=None)
+    parser.add_argument('--corpus', action='append', default=None)
+    parser.add_argument('--family', action='append', default=None, choices=sorted(BENCHMARK_FAMILIES))
+    parser.add_argument('--no-corpora', action='store_true')
+    parser.add_argument('--no-families', action='store_true')
+    parser.add_argument('--no-memory', action='store_true')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--save-baseline', default=None)
+    parser.add_argument('--threshold', action='append', default=[], metavar='MEASURE=FRACTION')
+    args = parser.parse_args(argv)
+    thresholds = dict(BENCHMARK_THRESHOLDS)
+    for setting in args.threshold:
+        measure, _, fraction = setting.partition('=')
+        if measure not in thresholds:
+            parser.error('unknown measure %r, expected one of %s' % (measure, ', '.join(sorted(thresholds))))
+        thresholds[measure] = (float(fraction), thresholds[measure][1])
+    corpora = [] if args.no_corpora else args.corpus or BENCHMARK_CORPORA
+    families = {}
+    if not args.no_families:
+        for family in args.family or BENCHMARK_FAMILIES:
+            families[family] = BENCHMARK_FAMILIES[family]
+    budget = Budget(args.max_steps, None, None, args.max_seconds)
+    baseline = []
+    if args.baseline is not None:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+
+    out = sys.stdout
+    out.write('%-18s %5s %12s %12s %10s %12s %6s %s\n' % ('suite', 'case', 'parse', 'sat', 'branches', 'peak',
+                                                          'answer', 'output'))
+    records = []
+    for record in run_benchmarks(benchmark_cases(args.root, corpora, families), budget, not args.no_memory,
+                                 args.repeat):
+        records.append(record)
+        values = [benchmark_value(measure, record[measure]) for measure in BENCHMARK_COLUMNS]
+        answer = '-' if record['answer'] is None else str(record['answer'])
+        out.write('%-18s %5s %12s %12s %10s %12s %6s %s\n' % (record['suite'], record['name'], values[0], values[1],
+                                                              values[2], values[3], answer,
+                                                              'ok' if record['matches'] else 'MISMATCH'))
+        out.flush()
+    total = sum(record['sat_seconds'] or 0.0 for record in records)
+    out.write('%d formulas, %.2fs in sat\n' % (len(records), total))
+
+    regressions = benchmark_regressions(records, baseline, thresholds)
+    for regression in regressions:
+        out.write('regression: %s\n' % regression)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as stream:
+            json.dump(records, stream, indent=1)
+    return 1 if regressions else 0
+
+###### library and service
+
+# importing this file only defines things; the driver runs under the
+# __main__ guard at the bottom. besides parse, lhs, con, rhs and sat,
+# callers get classify and batch_sat below, and the service after them
+# answers the same questions as JSON lines over a Unix socket or stdio
+
+# the description parse's code stands for, as the driver prints it
+def classify(fmla):
+    return PARSE_OUTPUTS[analyse(fmla).code]
+
+# satisfiability of every formula in texts, a SatResult or None for a text
+# that is not a formula
+def sat_texts(texts, schedule='dfs', budget=None, cache=None, engine='ground'):
+    results = []
+    for text in texts:
+        parsed = analyse(text)
+        if not parsed.code:
+            results.append(None)
+        elif cache is not None:
+            results.append(cached_sat([TableauNode(parsed.formula)], cache, schedule, budget, engine))
+        else:
+            results.append(sat([TableauNode(parsed.formula)], schedule, budget, engine=engine))
+    return results
+
+# sat_texts over many texts, in order; with workers other than 1 they are
+# checked chunk_size at a time on that many processes (None for one per
+# CPU) the way batch does it, and the cache, which lives in this process,
+# is not used
+def batch_sat(texts, schedule='dfs', budget=None, workers=1, cache=None, chunk_size=64, engine='ground'):
+    if workers == 1:
+        return sat_texts(texts, schedule, budget, cache, engine)
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(sat_texts, chunk, schedule, budget, None, engine) for chunk in chunked(texts, chunk_size)]
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+# the budget of one request: its max_steps and max_seconds replace the
+# service's own limits
+def request_budget(request, budget):
+    if budget is None:
+        budget = Budget()
+    steps = request.get('max_steps', budget.max_steps)
+    seconds = request.get('max_seconds', budget.max_seconds)
+    return Budget(steps, budget.max_branches, budget.max_memory, seconds, budget.max_constants)
+
+# the answer about one formula: code is None for a text that is not a
+# formula, answer the driver's words for it and witness the witness_lines
+# of the result when one was asked for
+def sat_reply(text, request, cache, budget):
+    parsed = analyse(text)
+    if not parsed.code:
+        return {'formula': text, 'code': None, 'answer': 'is not a formula'}
+    tableau = [TableauNode(parsed.formula)]
+    schedule = request.get('schedule', 'dfs')
+    if schedule not in SCHEDULERS:
+        raise ValueError('unknown schedule %r' % schedule)
+    engine = request.get('engine', 'ground')
+    if engine not in ENGINES:
+        raise ValueError('unknown engine %r' % engine)
+    budget = request_budget(request, budget)
+    if request.get('witness'):
+        out = sat(tableau, schedule, budget, witness=True, engine=engine)
+    else:
+        out = cached_sat(tableau, cache, schedule, budget, engine)
+    reply = {'formula': text, 'code': int(out), 'answer': SAT_OUTPUTS[out], 'reason': out.reason}
+    if request.get('witness'):
+        reply['witness'] = list(witness_lines(out))
+    return reply
+
+# the reply to one request of the service, both JSON objects. ops:
+#   {"op": "parse", "formula": F}       code, description and, for binary
+#                                       formulas, lhs, con and rhs
+#   {"op": "sat", "formula": F}         see sat_reply, with optional
+#                                       "schedule", "engine", "witness",
+#                                       "max_steps" and "max_seconds"
+#   {"op": "batch", "formulas": [F..]}  "results", one sat_reply each
+#   {"op": "stats"}                     formulas interned and cache counters
+# a request's "id", if any, is copied into its reply; a request that cannot
+# be answered gets an "error" instead
+def handle_request(request, cache, budget=None):
+    reply = {}
+    try:
+        if not isinstance(request, dict):
+            raise ValueError('a request is a JSON object')
+        if 'id' in request:
+            reply['id'] = request['id']
+        op = request.get('op')
+        if op == 'parse':
+            parsed = analyse(request['formula'])
+            reply['code'] = parsed.code
+            reply['description'] = PARSE_OUTPUTS[parsed.code]
+            if parsed.code in [5, 8]:
+                reply['lhs'] = parsed.lhs
+                reply['con'] = parsed.con
+                reply['rhs'] = parsed.rhs
+        elif op == 'sat':
+            reply.update(sat_reply(request['formula'], request, cache, budget))
+        elif op == 'batch':
+            reply['results'] = [sat_reply(text, request, cache, budget) for text in request['formulas']]
+        elif op == 'stats':
+            reply['formulas'] = len(_FORMULAS)
+            reply['cache'] = cache.stats()
+        else:
+            raise ValueError('unknown op %r' % (op,))
+    except KeyError as error:
+        reply['error'] = 'missing %s' % error
+    except (TypeError, ValueError) as error:
+        reply['error'] = str(error)
+    # interned formulas are kept between requests, as many as batch keeps
+    trim_formula_table()
+    return reply
+
+# answer the requests of one client, one JSON object per line, in the order
+# they came. a client can send requests without waiting for the replies:
+# they queue up unread while one is worked out on the single thread of
+# executor, so the event loop keeps serving other clients meanwhile
+async def serve_client(readline, write, drain, cache, budget, executor):
+    import asyncio
+    import json
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await readline()
+        if not line:
+            return
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            reply = {'error': 'bad JSON: %s' % error}
+        else:
+            reply = await loop.run_in_executor(executor, handle_request, request, cache, budget)
+        write((json.dumps(reply) + '\n').encode())
+        await drain()
+
+# run the service until it is stopped, on the Unix socket at path or on
+# stdin and stdout when path is None. requests are answered one at a time,
+# sharing the interned formulas and a SatCache made from cache_spec, a
+# (capacity, path) pair as batch takes
+async def serve(path=None, cache_spec=(100000, None), budget=None):
+    import asyncio
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    # an SQLite connection only works on the thread that opened it, so the
+    # cache is made, used and closed on the executor's
+    cache = await loop.run_in_executor(executor, SatCache, cache_spec[0], cache_spec[1])
+    try:
+        if path is None:
+            # stdin can be a file as well as a pipe, so it is read on a
+            # thread of its own rather than through a pipe transport
+            reader = ThreadPoolExecutor(max_workers=1)
+            stdin = sys.stdin.buffer
+            stdout = sys.stdout.buffer
+
+            async def readline():
+                return await loop.run_in_executor(reader, stdin.readline)
+
+            async def drain():
+                stdout.flush()
+
+            try:
+                await serve_client(readline, stdout.write, drain, cache, budget, executor)
+            finally:
+                reader.shutdown(wait=False)
+            return
+
+        async def client(reader, writer):
+            try:
+                await serve_client(reader.readline, writer.write, writer.drain, cache, budget, executor)
+            except (ConnectionError, asyncio.CancelledError):
+                # the client went away, or the service is stopping
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(client, path)
+        async with server:
+            await server.serve_forever()
+    finally:
+        await loop.run_in_executor(executor, cache.close)
+        executor.shutdown()
+
+# python3 tableau.py --serve [--socket PATH] [--cache-size N] [--cache-file PATH]
+#                            [--max-steps N] [--max-seconds S]
+# answers handle_request's JSON lines on the Unix socket at PATH, or on
+# stdin and stdout, until interrupted or stdin ends
+def serve_main(argv):
+    import argparse
+    import asyncio
+    import os
+    parser = argparse.ArgumentParser(prog='tableau.py --serve')
+    parser.add_argument('--socket', default=None)
+    parser.add_argument('--cache-size', type=int, default=100000)
+    parser.add_argument('--cache-file', default=None)
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args(argv)
+    budget = Budget(args.max_steps, None, None, args.max_seconds)
+    try:
+        asyncio.run(serve(args.socket, (args.cache_size, args.cache_file), budget))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+############################################################################################################
+
+# the driver that came with the assignment, unchanged except that it is a
+# function of the input file, run by the guard below, so importing this
+# file reads nothing
+def driver(path='input.txt'):
+    f = open(path)
+
+    parseOutputs = ['not a formula',
+                    'an atom',
+                    'a negation of a first order logic formula',
+                    'a universally quantified formula',
+                    'an existentially quantified formula',
+                    'a binary connective first order formula',
+                    'a proposition',
+                    'a negation of a propositional formula',
+                    'a binary connective propositional formula']
+
+    satOutput = ['is not satisfiable', 'is satisfiable', 'may or may not be satisfiable']
+
+
+
+    firstline = f.readline()
+
+    PARSE = False
+    if 'PARSE' in firstline:
+        PARSE = True
+
+    SAT = False
+    if 'SAT' in firstline:
+        SAT = True
+
+    for line in f:
+        if line[-1] == '\n':
+            line = line[:-1]
+        parsed = parse(line)
+
+        if PARSE:
+            output = "%s is %s." % (line, parseOutputs[parsed])
+            if parsed in [5,8]:
+                output += " Its left hand side is %s, its connective is %s, and its right hand side is %s." % (lhs(line), con(line) ,rhs(line))
+            print(output)
+
+        if SAT:
+            if parsed:
+                tableau = [theory(line)]
+                print('%s %s.' % (line, satOutput[sat(tableau)]))
+            else:
+                print('%s is not a formula.' % line)
+
+
+if __name__ == '__main__':
+    import sys
+    own_formula_table()
+    if sys.argv[1:2] == ['--batch']:
+        batch_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['--compile']:
+        compile_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['--benchmark']:
+        raise SystemExit(benchmark_main(sys.argv[2:]))
+    elif sys.argv[1:2] == ['--profile']:
+        profile_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['--serve']:
+        serve_main(sys.argv[2:])
+    else:
+        driver()